@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""Adaptive choice of trial conditions.
+
+Instead of showing every condition of the grid the same number of times,
+the mean rating over the whole grid is modelled as a Gaussian process, and
+each trial shows the condition that would most reduce the total uncertainty
+of the model. Conditions are only ever observed at grid cells, so the
+posterior is kept exactly on the grid and each rating updates it in O(n^2)
+for n cells (125: well under a millisecond).
+
+How uncertain the model is, and so which condition is worth showing next,
+depends on how smooth the ratings turn out to be and how much they vary:
+once there are enough ratings, the correlation lengths, the spread of the
+condition means, the noise of single ratings and the overall mean are
+refitted to them (by maximum marginal likelihood) every few ratings, and
+the posterior is rebuilt from all the ratings so far. A refit takes a few
+tens of milliseconds for 125 cells, and happens between trials.
+"""
+
+import numpy as np
+
+# correlation length of the model along each variable, in levels (grid
+# steps): how far one rating informs its neighbours
+LENGTH_SCALES: tuple = (1.5, 1.5, 1.5)
+# prior mean and standard deviation of the mean rating of a condition
+PRIOR_MEAN: float = 40.0
+SIGNAL_SD: float = 20.0
+# standard deviation of one rating around its condition's mean
+NOISE_SD: float = 25.0
+# the values above are only used until this many ratings are in; after
+# that the model is refitted to the ratings every REFIT_EVERY ratings
+MIN_FIT_RATINGS: int = 20
+REFIT_EVERY: int = 5
+# range each fitted length scale and standard deviation is kept in, so
+# that a few unlucky ratings cannot make the model degenerate
+LENGTH_SCALE_RANGE: tuple = (0.5, 20.0)
+SD_RANGE: tuple = (1.0, 100.0)
+# gradient ascent steps per fit (each a Cholesky of at most n cells)
+FIT_STEPS: int = 50
+
+
+class GridDesign:
+    """
+    Gaussian process model of the mean rating at each cell of a grid of
+    conditions, which chooses the cell to show next.
+    """
+
+    def __init__(self, shape: tuple, seed: int = 0,
+                 length_scales: tuple = LENGTH_SCALES,
+                 prior_mean: float = PRIOR_MEAN, signal_sd: float = SIGNAL_SD,
+                 noise_sd: float = NOISE_SD) -> None:
+        """
+        Parameters
+        ----------
+        shape: tuple[int] number of levels of each variable.
+        seed: int seed for breaking ties between equally good cells.
+        length_scales: tuple[float] correlation length along each variable,
+        in levels, until the model is first fitted.
+        prior_mean: float prior mean rating of every cell, until then.
+        signal_sd: float prior standard deviation of every cell's mean,
+        until then.
+        noise_sd: float standard deviation of one rating, until then.
+        """
+        self.shape = tuple(shape)
+        self.seed = seed
+        # (n cells, n variables) level indices of each cell, in the same
+        # (C) order as np.ravel_multi_index()
+        self.cells = np.indices(self.shape).reshape(len(self.shape), -1).T
+        # (n variables, n cells, n cells) squared distance between each
+        # pair of cells along each variable, in levels
+        self.sq_dists = (self.cells.T[:, :, np.newaxis]
+                         - self.cells.T[:, np.newaxis]) ** 2.0
+        # number, sum and sum of squares of the ratings of each cell
+        self.counts = np.zeros(len(self.cells))
+        self.sums = np.zeros(len(self.cells))
+        self.sums_sq = np.zeros(len(self.cells))
+        self.n_obs = 0
+        self.set_params(np.log(np.concatenate(
+            [np.asarray(length_scales, dtype=float), [signal_sd, noise_sd]])),
+            prior_mean)
+
+    def set_params(self, log_params: np.array, prior_mean: float) -> None:
+        """
+        Set the hyperparameters, and rebuild the posterior from every rating
+        so far.
+
+        Parameters
+        ----------
+        log_params: np.array log of each length scale, then of the signal
+        and noise standard deviations.
+        prior_mean: float prior mean rating of every cell.
+
+        Returns
+        -------
+        None.
+        """
+        self.log_params = log_params
+        self.prior_mean = prior_mean
+        self.noise_var = np.exp(2 * log_params[-1])
+        prior_cov = self.prior_cov(log_params)
+        seen = np.flatnonzero(self.counts)
+        self.mean = np.full(len(self.cells), float(prior_mean))
+        self.cov = prior_cov
+        if len(seen) == 0:
+            return
+        # the mean rating of a cell seen n times has noise variance
+        # noise_var / n
+        k = prior_cov[:, seen]
+        chol = np.linalg.cholesky(
+            k[seen] + np.diag(self.noise_var / self.counts[seen]))
+        residual = self.sums[seen] / self.counts[seen] - prior_mean
+        alpha = np.linalg.solve(chol.T, np.linalg.solve(chol, residual))
+        v = np.linalg.solve(chol, k.T)
+        self.mean = self.mean + k @ alpha
+        self.cov = prior_cov - v.T @ v
+
+    def prior_cov(self, log_params: np.array) -> np.array:
+        """
+        Returns the prior covariance of the cell means.
+
+        Parameters
+        ----------
+        log_params: np.array as in set_params().
+
+        Returns
+        -------
+        np.array (n cells, n cells) covariance.
+        """
+        inv_sq_scales = np.exp(-2 * log_params[:-2])
+        return np.exp(2 * log_params[-2]
+                      - 0.5 * np.tensordot(inv_sq_scales, self.sq_dists, 1))
+
+    def log_likelihood(self, log_params: np.array) -> tuple:
+        """
+        Returns the log marginal likelihood of the ratings so far, with the
+        prior mean that maximizes it, and its gradient.
+
+        Parameters
+        ----------
+        log_params: np.array as in set_params().
+
+        Returns
+        -------
+        tuple[float, np.array, float] log likelihood (up to a constant),
+        its gradient with respect to log_params, and the prior mean.
+        """
+        seen = np.flatnonzero(self.counts)
+        counts = self.counts[seen]
+        means = self.sums[seen] / counts
+        noise_var = np.exp(2 * log_params[-1])
+        k = self.prior_cov(log_params)[np.ix_(seen, seen)]
+        chol = np.linalg.cholesky(k + np.diag(noise_var / counts))
+        inv = np.linalg.solve(chol.T, np.linalg.solve(
+            chol, np.eye(len(seen))))
+        prior_mean = inv.sum(axis=0) @ means / inv.sum()
+        alpha = inv @ (means - prior_mean)
+        # spread of the ratings within each cell, which only the noise
+        # explains
+        within = (self.sums_sq[seen] - self.sums[seen] * means).sum()
+        n_within = self.n_obs - len(seen)
+        value = -0.5 * (means - prior_mean) @ alpha\
+            - np.log(np.diag(chol)).sum()\
+            - n_within * log_params[-1] - 0.5 * within / noise_var
+        # d value / d A = (alpha alpha' - A^-1) / 2 for A = k + noise
+        q = 0.5 * (np.outer(alpha, alpha) - inv)
+        dists = self.sq_dists[:, seen][:, :, seen]
+        gradient = np.concatenate([
+            ((q * k)[np.newaxis] * dists).sum(axis=(1, 2))
+            * np.exp(-2 * log_params[:-2]),
+            [2 * (q * k).sum(),
+             2 * noise_var * (np.diag(q) / counts).sum()
+             - n_within + within / noise_var]])
+        return (value, gradient, prior_mean)
+
+    def fit(self) -> None:
+        """
+        Fit the hyperparameters to the ratings so far, by gradient ascent
+        on the log marginal likelihood from the current ones, and rebuild
+        the posterior with them.
+
+        Parameters
+        ----------
+        None taken.
+
+        Returns
+        -------
+        None.
+        """
+        n_scales = len(self.shape)
+        low = np.log([LENGTH_SCALE_RANGE[0]] * n_scales + [SD_RANGE[0]] * 2)
+        high = np.log([LENGTH_SCALE_RANGE[1]] * n_scales + [SD_RANGE[1]] * 2)
+        params = np.clip(self.log_params, low, high)
+        (value, gradient, prior_mean) = self.log_likelihood(params)
+        step = 0.1
+        for _ in range(FIT_STEPS):
+            # steps are normalized, so step is the largest change of any
+            # log parameter
+            candidate = np.clip(
+                params + step * gradient / np.abs(gradient).max(), low, high)
+            (new_value, new_gradient, new_mean) = \
+                self.log_likelihood(candidate)
+            if new_value > value:
+                (params, value, gradient, prior_mean) = \
+                    (candidate, new_value, new_gradient, new_mean)
+                step *= 1.5
+            else:
+                step /= 4
+                if step < 1e-3:
+                    break
+        self.set_params(params, prior_mean)
+
+    def params(self) -> dict:
+        """
+        Returns the current hyperparameters.
+
+        Parameters
+        ----------
+        None taken.
+
+        Returns
+        -------
+        dict length_scales, signal_sd, noise_sd and prior_mean.
+        """
+        values = np.exp(self.log_params)
+        return {"length_scales": tuple(values[:-2]),
+                "signal_sd": values[-2], "noise_sd": values[-1],
+                "prior_mean": self.prior_mean}
+
+    def update(self, cell: tuple, rating: float) -> None:
+        """
+        Add a rating to the model, refitting it to every rating so far if
+        it is due.
+
+        Parameters
+        ----------
+        cell: tuple[int] level index of each variable.
+        rating: float the rating given.
+
+        Returns
+        -------
+        None.
+        """
+        c = np.ravel_multi_index(tuple(cell), self.shape)
+        self.counts[c] += 1
+        self.sums[c] += rating
+        self.sums_sq[c] += rating ** 2
+        self.n_obs += 1
+        if self.n_obs >= MIN_FIT_RATINGS\
+                and (self.n_obs - MIN_FIT_RATINGS) % REFIT_EVERY == 0:
+            self.fit()
+            return
+        k = self.cov[:, c].copy()
+        s = k[c] + self.noise_var
+        self.mean += k * ((rating - self.mean[c]) / s)
+        self.cov -= np.outer(k, k / s)
+
+    def sd(self) -> np.array:
+        """
+        Returns the posterior standard deviation of each cell's mean.
+
+        Parameters
+        ----------
+        None taken.
+
+        Returns
+        -------
+        np.array with the grid's shape.
+        """
+        return np.sqrt(np.maximum(np.diag(self.cov), 0)).reshape(self.shape)
+
+    def choose(self) -> tuple:
+        """
+        Choose the cell whose rating would most reduce the total posterior
+        variance of the grid, under the hyperparameters fitted so far. Ties
+        are broken at random, reproducibly for the same seed and ratings.
+
+        Parameters
+        ----------
+        None taken.
+
+        Returns
+        -------
+        tuple[int] level index of each variable.
+        """
+        reduction = (self.cov ** 2).sum(axis=0)\
+            / (np.diag(self.cov) + self.noise_var)
+        best = np.flatnonzero(reduction >= reduction.max() * (1 - 1e-9))
+        rng = np.random.default_rng([self.seed, self.n_obs])
+        return tuple(int(i) for i in self.cells[rng.choice(best)])
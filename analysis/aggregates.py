@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Summary statistics of the ratings for every level and condition cell.
+
+Built with one groupby per grouping instead of masking the whole table for
+every level, and cached with the dataset it came from.
+"""
+
+from itertools import combinations
+import os
+import numpy as np
+import pandas as pd
+
+from dataset import CACHE_DIR, cache_key, load_cache, save_cache
+
+VARIABLES = ("line_length", "stim_radius", "stim_period")
+
+# every grouping in the index: each variable alone, each pair, and all three
+GROUPINGS = [by for n in range(1, len(VARIABLES) + 1)
+             for by in combinations(VARIABLES, n)]
+
+
+def aggregate(df: pd.DataFrame, by: tuple,
+              column: str = "rating") -> pd.DataFrame:
+    """
+    Summarize a column for each combination of levels of some variables.
+
+    Parameters
+    ----------
+    df: pd.DataFrame the results.
+    by: tuple[str] variables to group by.
+    column: str column to summarize.
+
+    Returns
+    -------
+    pd.DataFrame indexed by the levels of by, with the columns mean, sem,
+    count, q1, q2 (median), q3, iqr_lo and iqr_hi (the median -/+ 1.5 IQR,
+    the whiskers on the violin plots), and ratings (the raw values, as an
+    array per row).
+    """
+    grouped = df.groupby(list(by))[column]
+    stats = grouped.agg(["mean", "sem", "count"])
+    quartiles = grouped.quantile([0.25, 0.5, 0.75]).unstack()
+    stats["q1"] = quartiles[0.25]
+    stats["q2"] = quartiles[0.5]
+    stats["q3"] = quartiles[0.75]
+    stats["iqr_lo"] = stats["q2"] - 1.5 * (stats["q3"] - stats["q1"])
+    stats["iqr_hi"] = stats["q2"] + 1.5 * (stats["q3"] - stats["q1"])
+    stats["ratings"] = grouped.apply(np.asarray)
+    return stats
+
+
+def build_index(df: pd.DataFrame, column: str = "rating") -> dict:
+    """
+    Summarize a column for every grouping of the variables.
+
+    Parameters
+    ----------
+    df: pd.DataFrame the results.
+    column: str column to summarize.
+
+    Returns
+    -------
+    dict[tuple[str], pd.DataFrame] aggregate() for each of GROUPINGS.
+    """
+    return {by: aggregate(df, by, column) for by in GROUPINGS}
+
+
+def load_index(df: pd.DataFrame, column: str = "rating",
+               cache_dir: str = CACHE_DIR) -> dict:
+    """
+    Returns build_index() of a dataset, building it only if it is not
+    already cached for the exact same rows.
+
+    Parameters
+    ----------
+    df: pd.DataFrame the results, from dataset.load_dataset().
+    column: str column to summarize.
+    cache_dir: str directory to keep the cache in.
+
+    Returns
+    -------
+    dict[tuple[str], pd.DataFrame] aggregate() for each of GROUPINGS.
+    """
+    path = os.path.join(cache_dir, "index-" + column + ".pkl")
+    key = cache_key(df)
+    cache = load_cache(path)
+    if cache.get("key") != key:
+        cache = {"key": key, "index": build_index(df, column)}
+        save_cache(path, cache)
+    return cache["index"]
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""Bootstrap confidence intervals for the mean rating at each level and
+condition cell.
+
+Participants, not trials, are resampled: each resample draws as many
+participants as there are, with replacement, and pools all of their ratings.
+All the resamples in a chunk are drawn as one index matrix and reduced to
+per-participant weights, so a chunk is two matrix products. Chunks run in
+parallel, each seeded from its own child of one SeedSequence, so results
+depend only on the seed and not on the number of processes.
+
+Usage: python bootstrap.py [--resamples 10000] [--seed 0] [--jobs N]
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import os
+import numpy as np
+import pandas as pd
+
+from aggregates import GROUPINGS, VARIABLES
+from dataset import CACHE_DIR, cache_key, load_cache, load_dataset,\
+    save_cache
+
+N_RESAMPLES: int = 10000
+CONFIDENCE: float = 0.95
+SEED: int = 0
+# resamples per task. fixed, so the chunks (and their seeds) are the same
+# however many processes there are
+CHUNK_SIZE: int = 1000
+
+
+def participant_totals(df: pd.DataFrame, by: tuple,
+                       column: str = "rating") -> tuple:
+    """
+    Sum and count a column for each participant and combination of levels.
+
+    Parameters
+    ----------
+    df: pd.DataFrame the results, from dataset.load_dataset().
+    by: tuple[str] variables to group by.
+    column: str column to summarize.
+
+    Returns
+    -------
+    tuple[pd.Index, np.array, np.array] the combinations of levels, and the
+    (participants, combinations) arrays of sums and counts.
+    """
+    grouped = df.groupby(["participant"] + list(by))[column]
+    sums = grouped.sum().unstack(list(range(1, len(by) + 1)), fill_value=0)
+    counts = grouped.count().unstack(list(range(1, len(by) + 1)),
+                                     fill_value=0)
+    return (sums.columns, sums.to_numpy(dtype=float),
+            counts.to_numpy(dtype=float))
+
+
+def resample_means(sums: np.array, counts: np.array, n_resamples: int,
+                   seed: np.random.SeedSequence) -> np.array:
+    """
+    Compute the mean of each column over resamples of the participants.
+
+    Parameters
+    ----------
+    sums: np.array (participants, groups) sums of each participant.
+    counts: np.array (participants, groups) counts of each participant.
+    n_resamples: int number of resamples.
+    seed: np.random.SeedSequence seed of the resamples.
+
+    Returns
+    -------
+    np.array (n_resamples, groups) means; nan where a resample has no
+    ratings in a group.
+    """
+    n = len(sums)
+    picks = np.random.default_rng(seed).integers(0, n, (n_resamples, n))
+    # how many times each participant was picked in each resample
+    rows = np.arange(n_resamples)[:, np.newaxis] * n
+    weights = np.bincount((picks + rows).ravel(), minlength=n_resamples * n)\
+        .reshape(n_resamples, n).astype(float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (weights @ sums) / (weights @ counts)
+
+
+def bootstrap(df: pd.DataFrame, by: tuple, column: str = "rating",
+              n_resamples: int = N_RESAMPLES,
+              confidence: float = CONFIDENCE, seed: int = SEED,
+              pool: ProcessPoolExecutor = None) -> pd.DataFrame:
+    """
+    Percentile bootstrap confidence intervals of the mean of a column for
+    each combination of levels of some variables.
+
+    Parameters
+    ----------
+    df: pd.DataFrame the results, from dataset.load_dataset().
+    by: tuple[str] variables to group by.
+    column: str column to summarize.
+    n_resamples: int number of resamples.
+    confidence: float confidence level of the intervals.
+    seed: int seed of the resamples.
+    pool: ProcessPoolExecutor pool to run the chunks on. If None, they run
+    in this process.
+
+    Returns
+    -------
+    pd.DataFrame indexed by the levels of by, with the columns mean, ci_lo
+    and ci_hi.
+    """
+    (levels, sums, counts) = participant_totals(df, by, column)
+    sizes = [CHUNK_SIZE] * (n_resamples // CHUNK_SIZE)
+    if n_resamples % CHUNK_SIZE:
+        sizes.append(n_resamples % CHUNK_SIZE)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if pool is None:
+        chunks = [resample_means(sums, counts, size, s)
+                  for (size, s) in zip(sizes, seeds)]
+    else:
+        chunks = list(pool.map(resample_means, [sums] * len(sizes),
+                               [counts] * len(sizes), sizes, seeds))
+    means = np.concatenate(chunks)
+    alpha = (1 - confidence) / 2
+    (lo, hi) = np.nanquantile(means, [alpha, 1 - alpha], axis=0)
+    return pd.DataFrame({"mean": sums.sum(axis=0) / counts.sum(axis=0),
+                         "ci_lo": lo, "ci_hi": hi}, index=levels)
+
+
+def build_intervals(df: pd.DataFrame, column: str = "rating",
+                    n_resamples: int = N_RESAMPLES,
+                    confidence: float = CONFIDENCE, seed: int = SEED,
+                    jobs: int = None) -> dict:
+    """
+    Bootstrap every grouping of the variables on one process pool.
+
+    Parameters
+    ----------
+    df: pd.DataFrame the results, from dataset.load_dataset().
+    column: str column to summarize.
+    n_resamples: int number of resamples.
+    confidence: float confidence level of the intervals.
+    seed: int seed of the resamples.
+    jobs: int number of processes; defaults to the number of CPUs.
+
+    Returns
+    -------
+    dict[tuple[str], pd.DataFrame] bootstrap() for each of GROUPINGS.
+    """
+    with ProcessPoolExecutor(jobs) as pool:
+        return {by: bootstrap(df, by, column, n_resamples, confidence, seed,
+                              pool)
+                for by in GROUPINGS}
+
+
+def load_intervals(df: pd.DataFrame, column: str = "rating",
+                   n_resamples: int = N_RESAMPLES,
+                   confidence: float = CONFIDENCE, seed: int = SEED,
+                   jobs: int = None, cache_dir: str = CACHE_DIR) -> dict:
+    """
+    Returns build_intervals() of a dataset, building it only if it is not
+    already cached for the exact same rows and settings.
+
+    Parameters
+    ----------
+    df: pd.DataFrame the results, from dataset.load_dataset().
+    column: str column to summarize.
+    n_resamples: int number of resamples.
+    confidence: float confidence level of the intervals.
+    seed: int seed of the resamples.
+    jobs: int number of processes; defaults to the number of CPUs.
+    cache_dir: str directory to keep the cache in.
+
+    Returns
+    -------
+    dict[tuple[str], pd.DataFrame] bootstrap() for each of GROUPINGS.
+    """
+    path = os.path.join(cache_dir, "bootstrap-" + column + ".pkl")
+    key = (cache_key(df), n_resamples, confidence, seed)
+    cache = load_cache(path)
+    if cache.get("key") != key:
+        cache = {"key": key,
+                 "intervals": build_intervals(df, column, n_resamples,
+                                              confidence, seed, jobs)}
+        save_cache(path, cache)
+    return cache["intervals"]
+
+
+def main() -> None:
+    """
+    Entry point. Parses arguments and prints the intervals of each level.
+
+    Parameters
+    ----------
+    None taken.
+
+    Returns
+    -------
+    None.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--resamples", type=int, default=N_RESAMPLES)
+    parser.add_argument("--confidence", type=float, default=CONFIDENCE)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(),
+                        help="number of processes")
+    args = parser.parse_args()
+
+    intervals = load_intervals(load_dataset(), n_resamples=args.resamples,
+                               confidence=args.confidence, seed=args.seed,
+                               jobs=args.jobs)
+    for variable in VARIABLES:
+        print(intervals[(variable,)].round(2), end="\n\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""Compares groups of sessions (cohorts) with each other.
+
+A cohort is a dict of criteria, all of which a session must meet:
+    files: list[str] names of its results files.
+    participants: list[str] participants' initials.
+    start, end: str or datetime; sessions started on or after start and
+    before end.
+e.g. {"participants": ["em", "jm"], "end": "2022-09-01"}.
+
+Each cohort is summarized by the ratings at each level of each variable,
+with a Kruskal-Wallis test of whether the level matters. All the cohorts
+that need summarizing are done together, with one groupby per variable, and
+each summary is cached by the contents of the rows it came from, so adding
+a cohort (or a session outside it) does not recompute the others. Cached
+summaries that were not used with the current dataset are deleted whenever
+new ones are saved, so the cache does not grow with every change to data/.
+"""
+
+import glob
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+from scipy.stats import kruskal
+
+from aggregates import VARIABLES, aggregate
+from dataset import CACHE_DIR, load_cache, save_cache
+
+# columns a cohort's summary depends on, besides the one summarized
+COLUMNS = ["file", "participant", "session", "trial"] + list(VARIABLES)
+
+
+def select(df: pd.DataFrame, cohort: dict) -> pd.Series:
+    """
+    Find the rows of the sessions in a cohort.
+
+    Parameters
+    ----------
+    df: pd.DataFrame the results, from dataset.load_dataset().
+    cohort: dict criteria of the cohort (see the module docstring).
+
+    Returns
+    -------
+    pd.Series bool mask of the rows.
+    """
+    unknown = set(cohort) - {"files", "participants", "start", "end"}
+    if unknown:
+        raise ValueError("unknown cohort criteria: " + ", ".join(unknown))
+    mask = pd.Series(True, index=df.index)
+    if "files" in cohort:
+        mask &= df["file"].isin(cohort["files"])
+    if "participants" in cohort:
+        mask &= df["participant"].isin(cohort["participants"])
+    if "start" in cohort:
+        mask &= df["session"] >= pd.Timestamp(cohort["start"])
+    if "end" in cohort:
+        mask &= df["session"] < pd.Timestamp(cohort["end"])
+    return mask
+
+
+def rows_hash(df: pd.DataFrame, column: str = "rating") -> str:
+    """
+    Hash the contents of some rows of the results.
+
+    Parameters
+    ----------
+    df: pd.DataFrame the rows.
+    column: str column to be summarized.
+
+    Returns
+    -------
+    str hex digest.
+    """
+    values = pd.util.hash_pandas_object(df[COLUMNS + [column]], index=False)
+    return hashlib.sha1(values.to_numpy().tobytes()).hexdigest()
+
+
+def summarize(df: pd.DataFrame, cohorts: dict,
+              column: str = "rating") -> dict:
+    """
+    Summarize several cohorts at once.
+
+    Parameters
+    ----------
+    df: pd.DataFrame the results, from dataset.load_dataset().
+    cohorts: dict[str, dict] criteria of each cohort, by name.
+    column: str column to summarize.
+
+    Returns
+    -------
+    dict[str, dict] for each cohort: "levels", a dict of
+    aggregates.aggregate() of each of VARIABLES; "kruskal", a table of the
+    Kruskal-Wallis H and p of each variable; and "sessions", the files in
+    the cohort.
+    """
+    masks = {name: select(df, cohort) for (name, cohort) in cohorts.items()}
+    # a session can be in more than one cohort, so each gets its own copy
+    pooled = pd.concat([df[mask].assign(cohort=name)
+                        for (name, mask) in masks.items()],
+                       ignore_index=True)
+    summaries = {name: {"levels": {}, "sessions":
+                        sorted(df.loc[mask, "file"].unique())}
+                 for (name, mask) in masks.items()}
+    for variable in VARIABLES:
+        stats = aggregate(pooled, ("cohort", variable), column)
+        for name in summaries:
+            if name in stats.index.get_level_values("cohort"):
+                levels = stats.xs(name, level="cohort")
+            else:
+                # no rows in the cohort
+                levels = stats.iloc[:0].droplevel("cohort")
+            summaries[name]["levels"][variable] = levels
+
+    for (name, summary) in summaries.items():
+        tests = []
+        for variable in VARIABLES:
+            samples = list(summary["levels"][variable]["ratings"])
+            if len(samples) < 2:
+                tests.append((np.nan, np.nan))
+            else:
+                tests.append(tuple(kruskal(*samples)))
+        summary["kruskal"] = pd.DataFrame(tests, columns=["H", "p"],
+                                          index=pd.Index(VARIABLES,
+                                                         name="variable"))
+    return summaries
+
+
+def load_cohorts(df: pd.DataFrame, cohorts: dict, column: str = "rating",
+                 cache_dir: str = CACHE_DIR) -> dict:
+    """
+    Returns summarize() of some cohorts, only summarizing the ones whose
+    rows have changed since they were cached. Each summary's file is named
+    by its rows and by the dataset it was last used with.
+
+    Parameters
+    ----------
+    df: pd.DataFrame the results, from dataset.load_dataset().
+    cohorts: dict[str, dict] criteria of each cohort, by name.
+    column: str column to summarize.
+    cache_dir: str directory to keep the cache in.
+
+    Returns
+    -------
+    dict[str, dict] as summarize().
+    """
+    suffix = "-" + df.attrs["fingerprint"] + ".pkl"
+    summaries = {}
+    stale = {}
+    for (name, cohort) in cohorts.items():
+        key = rows_hash(df[select(df, cohort)], column)
+        path = os.path.join(cache_dir, "cohort-" + key + suffix)
+        # the same rows may have been summarized with an older dataset
+        for old_path in glob.glob(os.path.join(cache_dir,
+                                               "cohort-" + key + "-*.pkl")):
+            if old_path != path:
+                os.replace(old_path, path)
+        cache = load_cache(path)
+        if "summary" in cache:
+            summaries[name] = cache["summary"]
+        else:
+            stale[name] = (cohort, path)
+    if stale:
+        fresh = summarize(df, {name: cohort
+                               for (name, (cohort, _)) in stale.items()},
+                          column)
+        for (name, (_, path)) in stale.items():
+            save_cache(path, {"summary": fresh[name]})
+            summaries[name] = fresh[name]
+        # summaries not used since the dataset last changed
+        for old_path in glob.glob(os.path.join(cache_dir, "cohort-*.pkl")):
+            if not old_path.endswith(suffix):
+                os.remove(old_path)
+    return {name: summaries[name] for name in cohorts}
+
+
+def compare(summaries: dict, variable: str) -> pd.DataFrame:
+    """
+    Test whether the cohorts differ at each level of a variable.
+
+    Parameters
+    ----------
+    summaries: dict[str, dict] from summarize() or load_cohorts().
+    variable: str one of VARIABLES.
+
+    Returns
+    -------
+    pd.DataFrame indexed by the levels of the variable, with the median of
+    each cohort, and the Kruskal-Wallis H and p across the cohorts.
+    """
+    levels = [summary["levels"][variable]
+              for summary in summaries.values()]
+    table = pd.concat([s["q2"] for s in levels], axis=1,
+                      keys=list(summaries))
+    tests = []
+    for level in table.index:
+        samples = [s.loc[level, "ratings"] for s in levels
+                   if level in s.index]
+        if len(samples) < 2:
+            tests.append((np.nan, np.nan))
+        else:
+            tests.append(tuple(kruskal(*samples)))
+    (table["H"], table["p"]) = zip(*tests) if tests else ([], [])
+    return table
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""Loads every session in data/ into one table.
+
+Each session's CSV is parsed once and cached (in analysis/.cache/), along
+with its mtime, size and hash. Later loads only parse files that are new or
+have changed, so adding a participant only costs parsing their file.
+"""
+
+from datetime import datetime
+import glob
+import hashlib
+import os
+import pickle
+import re
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(HERE, "..", "data")
+CACHE_DIR = os.path.join(HERE, ".cache")
+
+# bump to invalidate every cache built by an older version of this module
+CACHE_VERSION: int = 3
+
+# trials per block of the sessions saved before the results had a block
+# column, which all ran runner.py's default protocol
+LEGACY_BLOCK_SIZE: int = 125
+
+# e.g. cd2022-10-1313-31-45.457695.csv: initials, then the time the session
+# started (str(datetime) with spaces removed and colons replaced by dashes)
+FILENAME = re.compile(r"^([a-z]+)(\d{4}-\d{2}-\d{2})(\d{2}-\d{2}-\d{2})"
+                      r"(\.\d+)?\.csv$")
+
+
+def parse_filename(filename: str) -> tuple:
+    """
+    Get the participant's initials and the session's start time from the
+    name of a results file.
+
+    Parameters
+    ----------
+    filename: str name of the file (not the full path).
+
+    Returns
+    -------
+    tuple[str, datetime] initials and start time.
+    """
+    match = FILENAME.match(filename)
+    if match is None:
+        raise ValueError("not a results file name: " + filename)
+    (initials, date, time, fraction) = match.groups()
+    return (initials, datetime.strptime(date + " " + time + (fraction or ".0"),
+                                        "%Y-%m-%d %H-%M-%S.%f"))
+
+
+def file_hash(path: str) -> str:
+    """
+    Hash the contents of a file.
+
+    Parameters
+    ----------
+    path: str path of the file.
+
+    Returns
+    -------
+    str hex digest.
+    """
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def read_session(path: str) -> pd.DataFrame:
+    """
+    Parse one session's results.
+
+    Parameters
+    ----------
+    path: str path of the CSV.
+
+    Returns
+    -------
+    pd.DataFrame the results, with the participant's initials, the
+    session's start time and the file name added as columns, and the block
+    of each trial if the file does not record it.
+    """
+    filename = os.path.basename(path)
+    (initials, start) = parse_filename(filename)
+    df = pd.read_csv(path)
+    if "block" not in df:
+        df.insert(1, "block", df["trial"] // LEGACY_BLOCK_SIZE)
+    df["participant"] = initials
+    df["session"] = start
+    df["file"] = filename
+    return df
+
+
+def cache_key(df: pd.DataFrame) -> str:
+    """
+    Identify the exact rows a cache is built from. df.attrs["fingerprint"]
+    only names the files the rows were loaded from, and pandas copies it to
+    every frame filtered or sliced from the table, so the rows themselves
+    are hashed as well.
+
+    Parameters
+    ----------
+    df: pd.DataFrame the results, from load_dataset() or a subset of them.
+
+    Returns
+    -------
+    str hex digest.
+    """
+    digest = hashlib.sha1(" ".join(
+        [df.attrs["fingerprint"], str(len(df))] + list(df.columns))
+        .encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False)
+                  .to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def load_cache(path: str) -> dict:
+    """
+    Load a cache file, or return an empty cache if it is missing or stale.
+
+    Parameters
+    ----------
+    path: str path of the cache file.
+
+    Returns
+    -------
+    dict the cached data.
+    """
+    try:
+        with open(path, "rb") as f:
+            cache = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return {}
+    if cache.get("version") != CACHE_VERSION:
+        return {}
+    return cache
+
+
+def save_cache(path: str, cache: dict) -> None:
+    """
+    Save a cache file, replacing any old one atomically.
+
+    Parameters
+    ----------
+    path: str path of the cache file.
+    cache: dict the data to cache.
+
+    Returns
+    -------
+    None.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    cache["version"] = CACHE_VERSION
+    with open(path + ".tmp", "wb") as f:
+        pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + ".tmp", path)
+
+
+def load_dataset(data_dir: str = DATA_DIR,
+                 cache_dir: str = CACHE_DIR) -> pd.DataFrame:
+    """
+    Load the results of every session in data_dir as one table.
+
+    Parameters
+    ----------
+    data_dir: str directory holding the results CSVs.
+    cache_dir: str directory to keep the cache in.
+
+    Returns
+    -------
+    pd.DataFrame the results of every session, sorted by file name. Has the
+    columns of the CSVs plus participant, session and file.
+    df.attrs["fingerprint"] identifies the exact set of files loaded; use
+    cache_key() to cache anything computed from the table (or part of it).
+    """
+    cache_path = os.path.join(cache_dir, "dataset.pkl")
+    cache = load_cache(cache_path)
+    cached = cache.get("files", {})
+    files = {}
+    changed = False
+    for path in sorted(glob.glob(os.path.join(data_dir, "*.csv"))):
+        filename = os.path.basename(path)
+        stat = os.stat(path)
+        entry = cached.get(filename)
+        if entry is not None and (entry["mtime"], entry["size"])\
+                == (stat.st_mtime, stat.st_size):
+            files[filename] = entry
+            continue
+        digest = file_hash(path)
+        if entry is not None and entry["hash"] == digest:
+            # touched but not changed
+            df = entry["df"]
+        else:
+            df = read_session(path)
+        files[filename] = {"mtime": stat.st_mtime, "size": stat.st_size,
+                           "hash": digest, "df": df}
+        changed = True
+    if changed or files.keys() != cached.keys():
+        save_cache(cache_path, {"files": files})
+
+    df = pd.concat([entry["df"] for entry in files.values()],
+                   ignore_index=True)
+    df.attrs["fingerprint"] = hashlib.sha1(
+        "\n".join([f + " " + e["hash"] for (f, e) in files.items()])
+        .encode()).hexdigest()
+    return df
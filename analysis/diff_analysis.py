@@ -1,47 +1,54 @@
 #!/usr/bin/env python3
-import statsmodels.api as sm
-from statsmodels.formula.api import ols
-from statsmodels.regression.linear_model import OLS
-from scipy.stats import kruskal
+"""Compares the distributions of the ratings in the first sessions to the
+ones collected since.
+
+Run to show the figures, or render them to files with figures.py.
+"""
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib import cm
-import glob
+
+from cohorts import compare, load_cohorts
+from dataset import load_dataset
+from normalize import load_normalized
+
+# normalize the ratings within each participant (or each block with
+# PER_BLOCK) before summarizing them: None, or one of normalize.METHODS
+NORMALIZE = None
+PER_BLOCK = False
 
 # this file is to compare the original four data files we had
 # to the total data we have now (as of 25 Nov).
 
-old_paths = [
-    "../data/em2022-07-2515-45-11.880430.csv",
-    "../data/jm2022-07-2814-16-17.947739.csv",
+old_files = [
+    "em2022-07-2515-45-11.880430.csv",
+    "jm2022-07-2814-16-17.947739.csv",
     # I spliced JM's data together (they were originally
     # 2 files since it was collected on 2 different days)
-    "../data/fh2022-07-2815-26-10.110517.csv"
+    "fh2022-07-2815-26-10.110517.csv"
 ]
-new_paths = [
-    "../data/cd2022-10-1313-31-45.457695.csv",
-    "../data/da2022-10-1314-48-29.454029.csv",
-    "../data/es2022-10-1811-04-40.793284.csv",
-    "../data/fb2022-10-2513-30-47.435680.csv",
-    "../data/gl2022-10-1814-51-40.116265.csv",
-    "../data/gs2022-10-0615-58-48.460297.csv",
-    "../data/jr2022-10-0417-25-11.012646.csv",
-    "../data/jrc2022-10-0414-58-10.918166.csv",
-    "../data/kc2022-10-1813-20-55.967878.csv",
-    "../data/kt2022-10-0614-11-46.191964.csv",
-    "../data/lae2022-10-0716-01-58.313954.csv",
-    "../data/ml2022-11-0314-16-02.529894.csv",
-    "../data/tl2022-08-0513-05-29.891560.csv",
+new_files = [
+    "cd2022-10-1313-31-45.457695.csv",
+    "da2022-10-1314-48-29.454029.csv",
+    "es2022-10-1811-04-40.793284.csv",
+    "fb2022-10-2513-30-47.435680.csv",
+    "gl2022-10-1814-51-40.116265.csv",
+    "gs2022-10-0615-58-48.460297.csv",
+    "jr2022-10-0417-25-11.012646.csv",
+    "jrc2022-10-0414-58-10.918166.csv",
+    "kc2022-10-1813-20-55.967878.csv",
+    "kt2022-10-0614-11-46.191964.csv",
+    "lae2022-10-0716-01-58.313954.csv",
+    "ml2022-11-0314-16-02.529894.csv",
+    "tl2022-08-0513-05-29.891560.csv",
 ]
 
-# Old data first
-old_dfs = [pd.read_csv(path) for path in old_paths]
-old_df = pd.concat(old_dfs)
-
-# New data
-new_dfs = [pd.read_csv(path) for path in new_paths]
-new_df = pd.concat(new_dfs)
+# cohorts to compare, by name (see cohorts.py for the criteria)
+COHORTS = {
+    "old": {"files": old_files},
+    "new": {"files": new_files}
+}
 
 # Manipulate data
 variables = [
@@ -57,41 +64,6 @@ X = [
     [25, 50, 100, 150, 200]
 ]
 
-Y_old = [[old_df[old_df[variables[i]] == j]["rating"]
-          for j in X[i]] for i in range(3)]
-
-q1_old = []
-q2_old = []
-q3_old = []
-iqr_lo_old = []
-iqr_hi_old = []
-for i in range(3):
-    ps = np.percentile(Y_old[i], [25, 50, 75], axis=1)
-    q1_old.append(ps[0])
-    q2_old.append(ps[1])
-    q3_old.append(ps[2])
-    iqr_lo_old.append(ps[1] - 1.5 * (ps[2] - ps[0]))
-    iqr_hi_old.append(ps[1] + 1.5 * (ps[2] - ps[0]))
-inds_old = [np.arange(1, len(q2_old[i]) + 1) for i in range(3)]
-
-
-Y_new = [[new_df[new_df[variables[i]] == j]["rating"]
-          for j in X[i]] for i in range(3)]
-
-q1_new = []
-q2_new = []
-q3_new = []
-iqr_lo_new = []
-iqr_hi_new = []
-for i in range(3):
-    ps = np.percentile(Y_new[i], [25, 50, 75], axis=1)
-    q1_new.append(ps[0])
-    q2_new.append(ps[1])
-    q3_new.append(ps[2])
-    iqr_lo_new.append(ps[1] - 1.5 * (ps[2] - ps[0]))
-    iqr_hi_new.append(ps[1] + 1.5 * (ps[2] - ps[0]))
-inds_new = [np.arange(1, len(q2_new[i]) + 1) for i in range(3)]
-
 titles = [
     "illusion strength vs. line length",
     "illusion strength vs. stim radius",
@@ -104,67 +76,117 @@ ax_labels = [
     "animation period (s)"
 ]
 
-### OLD DATA ###
-
-fig = plt.figure(figsize=(14, 4))
-axs: list[plt.Axes] = [
-    fig.add_subplot(131),
-    fig.add_subplot(132),
-    fig.add_subplot(133),
-]
-
-# plt.rc('font', size=15)
-# plt.rc('xtick', labelsize=20)  # fontsize of the x tick labels
-# plt.rc('ytick', labelsize=20)  # fontsize of the y tick labels
-
-
-for i in range(3):
-    # plot distribution
-    # print(np.array(Y_old[i]).shape)
-    # axs[i].violinplot(Y_old[i])
-    # axs[i].violinplot(Y_new[i])
-
-    # for j in range(5):
-    # axs[i].scatter([j]*250, Y_old[i][j])  # looks REALLY bad
-
-    axs[i].violinplot(Y_old[i], showextrema=False)
-
-    axs[i].scatter(inds_old[i], q2_old[i], color='black', s=20)
-    axs[i].vlines(inds_old[i], iqr_lo_old[i],
-                  iqr_hi_old[i], color='grey', lw=2)
-    axs[i].vlines(inds_old[i], q1_old[i], q3_old[i], color='black', lw=3)
-
-    axs[i].set_title(titles[i])  # , fontsize=18)
-    axs[i].set_xlabel(ax_labels[i])  # , fontsize=14)
-    axs[i].set_ylabel("Average strength (%)")  # , fontsize=14)
-plt.show()
-
-### NEW DATA ###
-
-fig = plt.figure(figsize=(14, 4))
-axs: list[plt.Axes] = [
-    fig.add_subplot(131),
-    fig.add_subplot(132),
-    fig.add_subplot(133),
-]
-for i in range(3):
-    # plot distribution
-    # print(np.array(Y_old[i]).shape)
-    # axs[i].violinplot(Y_old[i])
-    # axs[i].violinplot(Y_new[i])
-
-    # for j in range(5):
-    # axs[i].scatter([j]*250, Y_old[i][j])  # looks REALLY bad
-
-    axs[i].violinplot(Y_new[i], showextrema=False)
-
-    axs[i].scatter(inds_new[i], q2_new[i], color='black', s=20)
-    axs[i].vlines(inds_new[i], iqr_lo_new[i],
-                  iqr_hi_new[i], color='grey', lw=2)
-    axs[i].vlines(inds_new[i], q1_new[i], q3_new[i], color='black', lw=3)
-
-    axs[i].set_title(titles[i])  # , fontsize=18)
-    axs[i].set_xlabel(ax_labels[i])  # , fontsize=14)
-    axs[i].set_ylabel("Average strength (%)")  # , fontsize=14)
 
-plt.show()
+def style() -> dict:
+    """
+    Returns the matplotlib settings of these figures, for plt.rc_context().
+
+    Parameters
+    ----------
+    None taken.
+
+    Returns
+    -------
+    dict rcParams.
+    """
+    # plt.rc('font', size=15)
+    # plt.rc('xtick', labelsize=20)  # fontsize of the x tick labels
+    # plt.rc('ytick', labelsize=20)  # fontsize of the y tick labels
+    return {}
+
+
+def violin_figure(stats: list) -> plt.Figure:
+    """
+    Plot the distribution of the ratings at each level of each variable.
+
+    Parameters
+    ----------
+    stats: list[pd.DataFrame] aggregates.aggregate() of each variable.
+
+    Returns
+    -------
+    plt.Figure the figure.
+    """
+    fig = plt.figure(figsize=(14, 4))
+    axs: list[plt.Axes] = [
+        fig.add_subplot(131),
+        fig.add_subplot(132),
+        fig.add_subplot(133),
+    ]
+
+    for i in range(3):
+        # plot distribution
+        # for j in range(5):
+        # axs[i].scatter([j]*250, Y_old[i][j])  # looks REALLY bad
+        inds = np.arange(1, len(stats[i]) + 1)
+
+        axs[i].violinplot(list(stats[i]["ratings"]), showextrema=False)
+
+        axs[i].scatter(inds, stats[i]["q2"], color='black', s=20)
+        axs[i].vlines(inds, stats[i]["iqr_lo"],
+                      stats[i]["iqr_hi"], color='grey', lw=2)
+        axs[i].vlines(inds, stats[i]["q1"], stats[i]["q3"], color='black',
+                      lw=3)
+
+        axs[i].set_title(titles[i])  # , fontsize=18)
+        axs[i].set_xlabel(ax_labels[i])  # , fontsize=14)
+        axs[i].set_ylabel("Average strength (%)")  # , fontsize=14)
+    return fig
+
+
+def figures(df: pd.DataFrame) -> list:
+    """
+    List every figure, with the data it is drawn from.
+
+    Parameters
+    ----------
+    df: pd.DataFrame the results, from dataset.load_dataset().
+
+    Returns
+    -------
+    list[tuple[str, callable, tuple]] name, function returning the figure,
+    and the arguments to call it with.
+    """
+    if NORMALIZE is not None:
+        df = load_normalized(df, NORMALIZE, PER_BLOCK)
+
+    summaries = load_cohorts(df, COHORTS)
+
+    # one figure per cohort, summarizing each variable with one row per
+    # level in X
+    return [("diff-" + name,
+             violin_figure,
+             ([summary["levels"][variables[i]].loc[X[i]] for i in range(3)],))
+            for (name, summary) in summaries.items()]
+
+
+def tests(df: pd.DataFrame) -> None:
+    """
+    Print the Kruskal-Wallis tests of each cohort, and between the cohorts
+    at each level of each variable.
+
+    Parameters
+    ----------
+    df: pd.DataFrame the results, from dataset.load_dataset().
+
+    Returns
+    -------
+    None.
+    """
+    if NORMALIZE is not None:
+        df = load_normalized(df, NORMALIZE, PER_BLOCK)
+    summaries = load_cohorts(df, COHORTS)
+    for (name, summary) in summaries.items():
+        print(name + ": " + str(len(summary["sessions"])) + " sessions")
+        print(summary["kruskal"], end="\n\n")
+    for variable in variables:
+        print(compare(summaries, variable), end="\n\n")
+
+
+if __name__ == "__main__":
+    df = load_dataset()
+    tests(df)
+    plt.rcParams.update(style())
+    for (_, function, args) in figures(df):
+        function(*args)
+        plt.show()
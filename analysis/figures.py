@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""Render every figure of the analysis scripts to files, without a display.
+
+Figures are drawn with the Agg backend on a process pool. The hash of each
+figure's input data (and of the code that draws it, and the module-level
+values it reads) is kept in the output directory, and figures whose hash
+has not changed since they were last rendered are skipped.
+
+Usage: python figures.py [--out figures] [--format png] [--jobs N] [--force]
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import inspect
+import json
+import logging
+import os
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+
+from dataset import HERE, load_dataset
+import diff_analysis
+import single_graph
+
+# scripts whose figures() are rendered
+SCRIPTS = (single_graph, diff_analysis)
+
+# file in the output directory holding the hash of each figure
+MANIFEST = "figures.json"
+
+# the fallback fonts have no medium weight; matplotlib warns on every text
+logging.getLogger("matplotlib.font_manager").setLevel(logging.ERROR)
+
+
+def feed(digest, value) -> None:
+    """
+    Add a value to a hash by its contents, so that equal data hashes the
+    same however it was built (pickles of equal tables can differ).
+
+    Parameters
+    ----------
+    digest: hashlib hash to update.
+    value: data to add: a table, array, sequence, dict or scalar.
+
+    Returns
+    -------
+    None.
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        feed(digest, value.index.tolist())
+        if isinstance(value, pd.Series):
+            value = value.to_frame()
+        for column in value.columns:
+            feed(digest, column)
+            feed(digest, list(value[column]))
+    elif isinstance(value, np.ndarray) and value.dtype != object:
+        digest.update(repr((value.dtype.str, value.shape)).encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (list, tuple, np.ndarray)):
+        digest.update(b"[")
+        for item in value:
+            feed(digest, item)
+        digest.update(b"]")
+    elif isinstance(value, dict):
+        feed(digest, sorted(value.items()))
+    else:
+        digest.update(repr(value).encode() + b",")
+
+
+def global_names(code) -> set:
+    """
+    Returns the global names a function's code (or any function nested in
+    it) can read.
+
+    Parameters
+    ----------
+    code: code object of the function.
+
+    Returns
+    -------
+    set[str] the names.
+    """
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names |= global_names(const)
+    return names
+
+
+def input_hash(function, args: tuple, style: dict) -> str:
+    """
+    Hash everything a figure is drawn from: the source of its script (which
+    also holds the helpers and the module-level settings the function
+    reads), the current values of the globals it reads, its arguments and
+    its style.
+
+    Parameters
+    ----------
+    function: callable function returning the figure.
+    args: tuple arguments to call it with.
+    style: dict rcParams to draw it with.
+
+    Returns
+    -------
+    str hex digest.
+    """
+    digest = hashlib.sha1(
+        inspect.getsource(inspect.getmodule(function)).encode())
+    feed(digest, function.__qualname__)
+    # values computed when the script is imported are not in its source
+    values = [(name, function.__globals__[name])
+              for name in sorted(global_names(function.__code__))
+              if name in function.__globals__]
+    feed(digest, [(name, value) for (name, value) in values
+                  if not callable(value) and not inspect.ismodule(value)])
+    feed(digest, (args, style))
+    return digest.hexdigest()
+
+
+def render(function, args: tuple, style: dict, path: str, dpi: int) -> str:
+    """
+    Draw one figure and save it.
+
+    Parameters
+    ----------
+    function: callable function returning the figure.
+    args: tuple arguments to call it with.
+    style: dict rcParams to draw it with.
+    path: str file to save it to; the format is taken from its extension.
+    dpi: int resolution.
+
+    Returns
+    -------
+    str path of the file written.
+    """
+    with plt.rc_context(style):
+        fig = function(*args)
+        fig.savefig(path + ".tmp", dpi=dpi,
+                    format=os.path.splitext(path)[1][1:])
+    plt.close(fig)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def main() -> None:
+    """
+    Entry point. Parses arguments and renders every figure that changed.
+
+    Parameters
+    ----------
+    None taken.
+
+    Returns
+    -------
+    None.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--out", default=os.path.join(HERE, "figures"),
+                        help="directory to write to")
+    parser.add_argument("--format", default="png",
+                        help="file format, e.g. png, pdf or svg")
+    parser.add_argument("--dpi", type=int, default=100)
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(),
+                        help="number of processes")
+    parser.add_argument("--force", action="store_true",
+                        help="render every figure, even if unchanged")
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    manifest_path = os.path.join(args.out, MANIFEST)
+    try:
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+
+    df = load_dataset()
+    with ProcessPoolExecutor(args.jobs) as pool:
+        jobs = {}
+        for script in SCRIPTS:
+            style = script.style()
+            for (name, function, fig_args) in script.figures(df):
+                filename = name + "." + args.format
+                path = os.path.join(args.out, filename)
+                digest = input_hash(function, fig_args, style)
+                if not args.force and manifest.get(filename) == digest\
+                        and os.path.exists(path):
+                    print("unchanged: " + path)
+                    continue
+                jobs[path] = (digest, pool.submit(render, function, fig_args,
+                                                  style, path, args.dpi))
+        for (path, (digest, job)) in jobs.items():
+            print(job.result(), flush=True)
+            manifest[os.path.basename(path)] = digest
+
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+if __name__ == "__main__":
+    main()
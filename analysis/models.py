@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""Fits models of the ratings over the line_length x stim_radius x
+stim_period design.
+
+Each model in MODELS is fit straight from the dataset, in parallel, and
+their coefficients are collected into one table, cached with the dataset it
+came from. The plotting scripts read their regression lines from this table.
+Mixed models have a random intercept for each participant; their "Group
+Var" term is its variance relative to the residual variance, which is given
+as the "Scale" term.
+
+Usage: python models.py [--out coefficients.csv] [--anova anova.csv]
+       [--jobs N]
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import os
+import warnings
+import pandas as pd
+import statsmodels.api as sm
+import statsmodels.formula.api as smf
+
+from dataset import CACHE_DIR, cache_key, load_cache, load_dataset,\
+    save_cache
+
+FACTORIAL = "C(line_length) * C(stim_radius) * C(stim_period)"
+
+# name: (kind, formula). kind is "ols", or "mixed" for a random intercept
+# per participant
+MODELS = {
+    # simple regressions, for the lines on the 2d plots
+    "line_length": ("ols", "rating ~ line_length"),
+    "stim_radius": ("ols", "rating ~ stim_radius"),
+    "stim_period": ("ols", "rating ~ stim_period"),
+    "linear": ("ols", "rating ~ line_length + stim_radius + stim_period"),
+    "linear_mixed": ("mixed",
+                     "rating ~ line_length + stim_radius + stim_period"),
+    "factorial": ("ols", "rating ~ " + FACTORIAL),
+    "factorial_mixed": ("mixed", "rating ~ " + FACTORIAL)
+}
+
+# columns of the coefficient table, in order
+COLUMNS = ("model", "kind", "term", "coef", "std_err", "p_value", "ci_lo",
+           "ci_hi", "n_obs")
+
+
+def fit(name: str, kind: str, formula: str, df: pd.DataFrame) -> tuple:
+    """
+    Fit one model.
+
+    Parameters
+    ----------
+    name: str name of the model.
+    kind: str "ols" or "mixed".
+    formula: str patsy formula of the model.
+    df: pd.DataFrame the results, from dataset.load_dataset().
+
+    Returns
+    -------
+    tuple[pd.DataFrame, pd.DataFrame] rows of the coefficient table, and
+    the model's type II ANOVA table (None for mixed models).
+    """
+    with warnings.catch_warnings():
+        # mixedlm warns about the boundary of the random effect's variance
+        warnings.simplefilter("ignore")
+        if kind == "ols":
+            result = smf.ols(formula, df).fit()
+        elif kind == "mixed":
+            result = smf.mixedlm(formula, df, groups=df["participant"]).fit()
+        else:
+            raise ValueError("unknown kind of model: " + str(kind))
+    ci = result.conf_int()
+    coefs = pd.DataFrame({
+        "model": name,
+        "kind": kind,
+        "term": result.params.index,
+        "coef": result.params.to_numpy(),
+        "std_err": result.bse.to_numpy(),
+        "p_value": result.pvalues.to_numpy(),
+        "ci_lo": ci[0].to_numpy(),
+        "ci_hi": ci[1].to_numpy(),
+        "n_obs": int(result.nobs)
+    })
+    if kind == "mixed":
+        # the residual variance, which "Group Var" is relative to
+        coefs = pd.concat([coefs, pd.DataFrame({
+            "model": [name], "kind": [kind], "term": ["Scale"],
+            "coef": [result.scale], "n_obs": [int(result.nobs)]})],
+            ignore_index=True)
+    anova = None
+    if kind == "ols":
+        anova = sm.stats.anova_lm(result, typ=2)
+        anova.insert(0, "model", name)
+    return (coefs, anova)
+
+
+def fit_models(df: pd.DataFrame, models: dict = MODELS,
+               jobs: int = None) -> tuple:
+    """
+    Fit several models in parallel.
+
+    Parameters
+    ----------
+    df: pd.DataFrame the results, from dataset.load_dataset().
+    models: dict[str, tuple[str, str]] name: (kind, formula) of each model.
+    jobs: int number of processes; defaults to the number of CPUs. If 1,
+    the models are fit in this process.
+
+    Returns
+    -------
+    tuple[pd.DataFrame, pd.DataFrame] the coefficient table (COLUMNS) and
+    the ANOVA tables of the OLS models, indexed by term.
+    """
+    df = df[["participant", "line_length", "stim_radius", "stim_period",
+             "rating"]]
+    args = [(name, kind, formula, df)
+            for (name, (kind, formula)) in models.items()]
+    if jobs == 1:
+        fits = [fit(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(jobs) as pool:
+            fits = list(pool.map(fit, *zip(*args)))
+    coefs = pd.concat([c for (c, _) in fits], ignore_index=True)
+    anovas = [a for (_, a) in fits if a is not None]
+    anova = pd.concat(anovas) if anovas else pd.DataFrame()
+    return (coefs, anova)
+
+
+def load_models(df: pd.DataFrame, jobs: int = None,
+                cache_dir: str = CACHE_DIR) -> tuple:
+    """
+    Returns fit_models() of a dataset with MODELS, fitting them only if
+    they are not already cached for the exact same rows.
+
+    Parameters
+    ----------
+    df: pd.DataFrame the results, from dataset.load_dataset().
+    jobs: int number of processes; defaults to the number of CPUs.
+    cache_dir: str directory to keep the cache in.
+
+    Returns
+    -------
+    tuple[pd.DataFrame, pd.DataFrame] as fit_models().
+    """
+    path = os.path.join(cache_dir, "models.pkl")
+    key = cache_key(df)
+    cache = load_cache(path)
+    if cache.get("key") != key or cache.get("models") != MODELS:
+        cache = {"key": key, "models": MODELS,
+                 "fits": fit_models(df, MODELS, jobs)}
+        save_cache(path, cache)
+    return cache["fits"]
+
+
+def coefficient(coefs: pd.DataFrame, model: str, term: str) -> float:
+    """
+    Look up one coefficient in the coefficient table.
+
+    Parameters
+    ----------
+    coefs: pd.DataFrame the coefficient table, from load_models().
+    model: str name of the model.
+    term: str name of the term, e.g. "Intercept".
+
+    Returns
+    -------
+    float the coefficient.
+    """
+    row = coefs[(coefs["model"] == model) & (coefs["term"] == term)]
+    if len(row) != 1:
+        raise KeyError(model + ": " + term)
+    return float(row["coef"].iloc[0])
+
+
+def main() -> None:
+    """
+    Entry point. Parses arguments, fits the models and writes the tables.
+
+    Parameters
+    ----------
+    None taken.
+
+    Returns
+    -------
+    None.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--out", default="coefficients.csv",
+                        help="file to write the coefficient table to")
+    parser.add_argument("--anova", help="file to write the ANOVA tables to")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(),
+                        help="number of processes")
+    args = parser.parse_args()
+
+    (coefs, anova) = load_models(load_dataset(), args.jobs)
+    coefs.to_csv(args.out, index=False, columns=COLUMNS)
+    if args.anova is not None:
+        anova.to_csv(args.anova, index_label="term")
+    # the factorial models have too many terms to print
+    print(coefs[~coefs["model"].str.startswith("factorial")]
+          .to_string(index=False, columns=COLUMNS[:6]))
+
+
+if __name__ == "__main__":
+    main()
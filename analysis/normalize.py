@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Per-participant normalization of the ratings.
+
+Ratings are given on an unlabeled slider, so each participant uses the scale
+differently. This rescales them within each participant (or within each
+block of each session) so they can be pooled. Every method is a grouped
+transform over the whole table, and the result is cached with the dataset
+it came from.
+"""
+
+import hashlib
+import os
+import pandas as pd
+
+from dataset import CACHE_DIR, cache_key, load_cache, save_cache
+
+# z: z-score. rank: mid-rank percentile (0-100). minmax: rescaled so the
+# lowest rating is 0 and the highest 100. groups where every rating is the
+# same get the middle of the scale (0 for z, 50 otherwise).
+METHODS = ("z", "rank", "minmax")
+
+
+def normalize(df: pd.DataFrame, method: str = "z", per_block: bool = False,
+              column: str = "rating") -> pd.DataFrame:
+    """
+    Normalize a column within each participant, or each block.
+
+    Parameters
+    ----------
+    df: pd.DataFrame the results, from dataset.load_dataset().
+    method: str one of METHODS.
+    per_block: bool whether to normalize each block of each session
+    separately, instead of each participant as a whole.
+    column: str column to normalize.
+
+    Returns
+    -------
+    pd.DataFrame a copy of df with column normalized, the original values in
+    "raw_" + column. df.attrs["fingerprint"] is updated
+    so that caches built from the result are kept apart from the raw data.
+    """
+    if method not in METHODS:
+        raise ValueError("unknown normalization: " + str(method))
+    df = df.copy()
+    keys = ["file", "block"] if per_block else ["participant"]
+    values = df[column].astype(float)
+    grouped = values.groupby([df[key] for key in keys])
+
+    if method == "z":
+        spread = grouped.transform("std")
+        normalized = (values - grouped.transform("mean")) / spread
+        normalized[spread == 0] = 0
+    elif method == "rank":
+        normalized = (grouped.rank() - 0.5) / grouped.transform("count") * 100
+    else:
+        low = grouped.transform("min")
+        spread = grouped.transform("max") - low
+        normalized = (values - low) / spread * 100
+        normalized[spread == 0] = 50
+
+    df["raw_" + column] = df[column]
+    df[column] = normalized
+    df.attrs["fingerprint"] = hashlib.sha1(
+        " ".join([df.attrs["fingerprint"], method, str(per_block), column])
+        .encode()).hexdigest()
+    return df
+
+
+def load_normalized(df: pd.DataFrame, method: str = "z",
+                    per_block: bool = False, column: str = "rating",
+                    cache_dir: str = CACHE_DIR) -> pd.DataFrame:
+    """
+    Returns normalize() of a dataset, computing it only if it is not already
+    cached for the exact same rows.
+
+    Parameters
+    ----------
+    df: pd.DataFrame the results, from dataset.load_dataset().
+    method: str one of METHODS.
+    per_block: bool whether to normalize each block of each session
+    separately, instead of each participant as a whole.
+    column: str column to normalize.
+    cache_dir: str directory to keep the cache in.
+
+    Returns
+    -------
+    pd.DataFrame as normalize().
+    """
+    level = "block" if per_block else "participant"
+    path = os.path.join(cache_dir, "-".join(
+        ["normalized", column, method, level]) + ".pkl")
+    key = cache_key(df)
+    cache = load_cache(path)
+    if cache.get("key") != key:
+        cache = {"key": key, "df": normalize(df, method, per_block, column)}
+        save_cache(path, cache)
+    return cache["df"]
@@ -1,20 +1,28 @@
 #!usr/bin/env/python3
+"""Figures of the illusion strength against each variable.
+
+Run to show them one by one, or render them all to files with figures.py.
+"""
 
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from matplotlib import cm
+from matplotlib import cm, font_manager
 from matplotlib.colors import LinearSegmentedColormap
-import glob
 
-paths = glob.glob("../data/*")
+from aggregates import load_index
+from bootstrap import load_intervals
+from dataset import load_dataset
+from models import coefficient, load_models
+from normalize import load_normalized
 
-dfs = [pd.read_csv(path) for path in paths]
-df = pd.concat(dfs)
+# normalize the ratings within each participant (or each block with
+# PER_BLOCK) before summarizing them: None, or one of normalize.METHODS
+NORMALIZE = None
+PER_BLOCK = False
 
-plt.rc('font', size=26)  # 26 for 2d plots
-plt.rcParams["font.family"] = "Ubuntu"
-plt.rcParams["font.weight"] = "medium"
+# the first of these that is installed is used
+FONTS = ["Ubuntu", "DejaVu Sans"]
 
 variables = [
     "line_length",
@@ -41,41 +49,57 @@ alt_ticklabels = [
     [2.62, 3.49, 4.36, 5.23, 6.09],
     list(np.array(X[2]) / 100)
 ]
-Y = [[df[df[variables[i]] == j]["rating"].sum()
-      / len(df[df[variables[i]] == j])
-      for j in X[i]] for i in range(3)]
-
-# for violin plots
-# 3d array: variable, x, and y
-V = [[df[df[variables[i]] == j]["rating"] for j in X[i]] for i in range(3)]
-q1 = []
-q2 = []
-q3 = []
-iqr_lo = []
-iqr_hi = []
-for i in range(3):
-    ps = np.percentile(V[i], [25, 50, 75], axis=1)
-    q1.append(ps[0])
-    q2.append(ps[1])
-    q3.append(ps[2])
-    iqr_lo.append(ps[1] - 1.5 * (ps[2] - ps[0]))
-    iqr_hi.append(ps[1] + 1.5 * (ps[2] - ps[0]))
-inds = [np.arange(1, len(q2[i]) + 1) for i in range(3)]
-
-S = [[df[df[variables[i]] == j]["rating"].sem() for j in X[i]]
-     for i in range(3)]
-azim = [
-    135,
-    -45,
-    225
-]
+# camera angle of the 3d plot of each pair of variables
+azim = {
+    (0, 1): 135,
+    (1, 2): -45,
+    (0, 2): 225
+}
+
+
+def style() -> dict:
+    """
+    Returns the matplotlib settings of these figures, for plt.rc_context().
+    Figures have to be drawn and saved with them in effect.
+
+    Parameters
+    ----------
+    None taken.
+
+    Returns
+    -------
+    dict rcParams.
+    """
+    installed = {f.name for f in font_manager.fontManager.ttflist}
+    font = next((f for f in FONTS if f in installed), FONTS[-1])
+    return {
+        "font.size": 26,  # 26 for 2d plots
+        "font.family": font,
+        "font.weight": "medium"
+    }
 
 
-def lin_reg(var, x):
-    if var == 0:
-        return 0.5032 + 0.4223 * x  # coefs from the table
-    elif var == 1:
-        return 71.43 - 0.1317 * x  # coefs from the table
+def prepare(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Normalize a dataset as set by NORMALIZE and PER_BLOCK.
+
+    Parameters
+    ----------
+    df: pd.DataFrame the results, from dataset.load_dataset().
+
+    Returns
+    -------
+    pd.DataFrame the results to plot.
+    """
+    if NORMALIZE is not None:
+        df = load_normalized(df, NORMALIZE, PER_BLOCK)
+    return df
+
+
+def lin_reg(coefs: pd.DataFrame, var: int, x: float) -> float:
+    # coefs from the table fit by models.py
+    return coefficient(coefs, variables[var], "Intercept")\
+        + coefficient(coefs, variables[var], variables[var]) * x
 
 
 def adjacent_values(vals, q1, q3):
@@ -87,111 +111,205 @@ def adjacent_values(vals, q1, q3):
     return lower_adjacent_value, upper_adjacent_value
 
 
-# derivative plot (pdf)
-# normalize illusion strength vs. line length
-normY = np.array(Y[0])
-normY *= 100 / np.max(Y[0])
-delta = [0] + [normY[i+1] - normY[i] for i in range(len(normY)-1)]
-fig = plt.figure(figsize=(10, 8))
-ax = fig.add_subplot(111)
-ax.plot(X[0], delta, linewidth=5, color="#cc0000", solid_capstyle="butt")
-ax.set_title("RF size distribution", weight="bold", pad=20)
-ax.set_xlabel("Size (°)", weight="medium")
-ax.set_xticks(X[0])
-ax.set_xticklabels(alt_ticklabels[0])
-ax.set_ylabel("Probability density", weight="medium")
-ax.set_yticklabels([])
-
-plt.tight_layout()
-plt.show()
-
-# 2d plots
-for VAR in range(3):
+def derivative_figure(means: list) -> plt.Figure:
+    """
+    Plot the change in illusion strength between line lengths (pdf).
+
+    Parameters
+    ----------
+    means: list[float] mean rating at each line length.
+
+    Returns
+    -------
+    plt.Figure the figure.
+    """
+    # normalize illusion strength vs. line length
+    normY = np.array(means, dtype=float)
+    normY *= 100 / np.max(normY)
+    delta = [0] + [normY[i+1] - normY[i] for i in range(len(normY)-1)]
     fig = plt.figure(figsize=(10, 8))
     ax = fig.add_subplot(111)
+    ax.plot(X[0], delta, linewidth=5, color="#cc0000",
+            solid_capstyle="butt")
+    ax.set_title("RF size distribution", weight="bold", pad=20)
+    ax.set_xlabel("Size (°)", weight="medium")
+    ax.set_xticks(X[0])
+    ax.set_xticklabels(alt_ticklabels[0])
+    ax.set_ylabel("Probability density", weight="medium")
+    ax.set_yticklabels([])
+    fig.tight_layout()
+    return fig
+
+
+def line_figure(VAR: int, stats: pd.DataFrame, intervals: pd.DataFrame,
+                lineY: list = None) -> plt.Figure:
+    """
+    Plot the mean illusion strength at each level of a variable (cdf).
+
+    Parameters
+    ----------
+    VAR: int index of the variable in variables.
+    stats: pd.DataFrame aggregates.aggregate() of the variable.
+    intervals: pd.DataFrame bootstrap.bootstrap() of the variable, for the
+    error bars.
+    lineY: list[float] the linear regression at the lowest and highest
+    level, to draw as a line, or None.
+
+    Returns
+    -------
+    plt.Figure the figure.
+    """
+    fig = plt.figure(figsize=(10, 8))
+    ax = fig.add_subplot(111)
+    ax.plot(X[VAR], stats["mean"], linewidth=5, color="#cc0000",
+            solid_capstyle="butt")
+    errors = [stats["mean"] - intervals["ci_lo"],
+              intervals["ci_hi"] - stats["mean"]]
+    ax.errorbar(X[VAR], stats["mean"], errors, capsize=7, fmt="none",
+                ecolor="#000000", linewidth=5, capthick=5,
+                solid_capstyle="round")
+    # linear regression
+    if lineY is not None:
+        lineX = [X[VAR][0], X[VAR][-1]]  # x-values used in linear regression
+        ax.plot(lineX, lineY, linestyle="dashed", color="grey", lw=5)
+    # set units on x-axis
+    ax.set_xticks(X[VAR])
+    ax.set_xticklabels(alt_ticklabels[VAR])
+
+    ax.set_title(chr(ord('A') + VAR) + ". Illusion strength vs. "
+                 + names[VAR], weight="bold", pad=20)
+    ax.set_xlabel(labels[VAR], weight="medium")
+    ax.set_ylabel("Average strength (%)", weight="medium")
+    fig.tight_layout()
+    return fig
 
-    # line plots
-    # ax.plot(X[VAR], Y[VAR], linewidth=5, color="#cc0000",
-    #         solid_capstyle="butt")  # normal plot (cdf)
-    # ax.errorbar(X[VAR], Y[VAR], S[VAR], capsize=7, fmt="none",
-    #             ecolor="#000000", linewidth=5, capthick=5, solid_capstyle="round")
-    # # set units on x-axis
-    # ax.set_xticks(X[VAR])
-    # ax.set_xticklabels(alt_ticklabels[VAR])
-    # end line plots
+
+def violin_figure(VAR: int, stats: pd.DataFrame) -> plt.Figure:
+    """
+    Plot the distribution of illusion strength at each level of a variable.
+
+    Parameters
+    ----------
+    VAR: int index of the variable in variables.
+    stats: pd.DataFrame aggregates.aggregate() of the variable.
+
+    Returns
+    -------
+    plt.Figure the figure.
+    """
+    inds = np.arange(1, len(stats) + 1)
+    fig = plt.figure(figsize=(10, 8))
+    ax = fig.add_subplot(111)
 
     # violin plots (from matplotlib documentation)
-    parts = ax.violinplot(V[VAR], showextrema=False)
+    parts = ax.violinplot(list(stats["ratings"]), showextrema=False)
     for (i, pc) in enumerate(parts['bodies']):
         pc.set_facecolor(plt.get_cmap("Pastel1").colors[i])
         pc.set_alpha(1)
 
     # show median
-    ax.scatter(inds[VAR], q2[VAR], color='black', s=150)
+    ax.scatter(inds, stats["q2"], color='black', s=150)
     # show whiskers (1.5 * IQR)
-    ax.vlines(inds[VAR], iqr_lo[VAR],
-              iqr_hi[VAR], color='grey', lw=3)
+    ax.vlines(inds, stats["iqr_lo"], stats["iqr_hi"], color='grey',
+              lw=3)
     # show quartiles
-    ax.vlines(inds[VAR], q1[VAR], q3[VAR], color='black', lw=5)
-
-# i don't know why I need to add an empty value and I don't care
-    ax.set_xticklabels([""] + alt_ticklabels[VAR])
-    # end violin plots
+    ax.vlines(inds, stats["q1"], stats["q3"], color='black', lw=5)
+    ax.set_xticks(inds)
+    ax.set_xticklabels(alt_ticklabels[VAR])
 
-    ax.set_title(chr(ord('A') + VAR) + ". Illusion strength vs. " + names[VAR],
-                 weight="bold", pad=20)
+    ax.set_title(chr(ord('A') + VAR) + ". Illusion strength vs. "
+                 + names[VAR], weight="bold", pad=20)
     ax.set_xlabel(labels[VAR], weight="medium")
     ax.set_ylabel("Average strength (%)", weight="medium")
+    fig.tight_layout()
+    return fig
 
-    # linear regression
-    # if VAR in [0, 1]:
-    #     lineX = [X[VAR][0], X[VAR][-1]] # x-values used in linear regression
-    #     plotX = [1, 5] # x-values to plot since we change the scale
-    #     lineY = [lin_reg(VAR, x) for x in lineX]
-    #     ax.plot(plotX, lineY, linestyle="dashed", color="grey", lw=5)
-
-    plt.tight_layout()
-    plt.show()
-
-# 3d plot
-# fig = plt.figure(figsize=(10, 8))
-# ax = fig.add_subplot(111, projection="3d")
-
-# ax.xaxis.labelpad=18
-# ax.yaxis.labelpad=18
-# ax.zaxis.labelpad=18
-
-# var1 = 0
-# var2 = 2
-# matrix = []
-# for i in range(5):
-#     row = []
-#     for j in range(5):
-#         filtered = df[(df[variables[var1]] == X[var1][i])
-#                       & (df[variables[var2]] == X[var2][j])]
-#         row.append(filtered["rating"].sum() / len(filtered))
-#     matrix.append(row)
-
-# XX, YY = np.meshgrid(X[var1], X[var2])
-# Z = np.array(matrix).transpose()
-# colors = ["#ffaaaa", "#cc0000", "black"]
-# colormap = LinearSegmentedColormap.from_list("customreds", colors)
-# # colormap = cm.Reds
-# # colormap.set_gamma(0.8)
-# ax.plot_surface(XX, YY, Z, cmap=colormap, antialiased=True, linewidth=0)
-# ax.azim = 225 # 135 for 0, 1; -45 for 1, 2; 225 for 0, 2
-# # ax.set_title("Effects of line length, stimulus radius",
-# #              weight="bold")
-# ax.set_xlabel(labels[var1], weight="medium")
-# ax.set_ylabel(labels[var2], weight="medium")
-# ax.set_zlabel("Average strength (%)", weight="medium")
-
-
-# change units on x-axis
-# ax.set_xticks(X[0])
-# ax.set_yticks(X[1])
-# ax.set_xticklabels(alt_ticklabels[0])
-# ax.set_yticklabels(alt_ticklabels[1])
-
-# plt.tight_layout()
-# plt.show()
+
+def surface_figure(var1: int, var2: int, matrix: np.array) -> plt.Figure:
+    """
+    Plot the mean illusion strength against two variables as a surface.
+
+    Parameters
+    ----------
+    var1: int index of the first variable in variables.
+    var2: int index of the second variable in variables.
+    matrix: np.array (levels of var1, levels of var2) mean ratings.
+
+    Returns
+    -------
+    plt.Figure the figure.
+    """
+    fig = plt.figure(figsize=(10, 8))
+    ax = fig.add_subplot(111, projection="3d")
+
+    ax.xaxis.labelpad = 18
+    ax.yaxis.labelpad = 18
+    ax.zaxis.labelpad = 18
+
+    XX, YY = np.meshgrid(X[var1], X[var2])
+    Z = np.asarray(matrix).transpose()
+    colors = ["#ffaaaa", "#cc0000", "black"]
+    colormap = LinearSegmentedColormap.from_list("customreds", colors)
+    # colormap = cm.Reds
+    # colormap.set_gamma(0.8)
+    ax.plot_surface(XX, YY, Z, cmap=colormap, antialiased=True,
+                    linewidth=0)
+    ax.azim = azim[(var1, var2)]
+    # ax.set_title("Effects of line length, stimulus radius",
+    #              weight="bold")
+    ax.set_xlabel(labels[var1], weight="medium")
+    ax.set_ylabel(labels[var2], weight="medium")
+    ax.set_zlabel("Average strength (%)", weight="medium")
+
+    # change units on x-axis
+    # ax.set_xticks(X[0])
+    # ax.set_yticks(X[1])
+    # ax.set_xticklabels(alt_ticklabels[0])
+    # ax.set_yticklabels(alt_ticklabels[1])
+    fig.tight_layout()
+    return fig
+
+
+def figures(df: pd.DataFrame) -> list:
+    """
+    List every figure, with the data it is drawn from.
+
+    Parameters
+    ----------
+    df: pd.DataFrame the results, from dataset.load_dataset().
+
+    Returns
+    -------
+    list[tuple[str, callable, tuple]] name, function returning the figure,
+    and the arguments to call it with.
+    """
+    df = prepare(df)
+    index = load_index(df)
+    intervals = load_intervals(df)
+    (coefs, _) = load_models(df)
+    stats = [index[(variables[i],)].loc[list(X[i])] for i in range(3)]
+
+    specs = [("derivative", derivative_figure, (list(stats[0]["mean"]),))]
+    for VAR in range(3):
+        lineY = None
+        if VAR in [0, 1]:
+            lineY = [lin_reg(coefs, VAR, x) for x in [X[VAR][0], X[VAR][-1]]]
+        specs.append(("line-" + variables[VAR], line_figure,
+                      (VAR, stats[VAR],
+                       intervals[(variables[VAR],)].loc[list(X[VAR])],
+                       lineY)))
+        specs.append(("violin-" + variables[VAR], violin_figure,
+                      (VAR, stats[VAR])))
+    for (var1, var2) in azim:
+        matrix = index[(variables[var1], variables[var2])]["mean"].unstack()\
+            .loc[list(X[var1]), list(X[var2])].to_numpy()
+        specs.append(("surface-" + variables[var1] + "-" + variables[var2],
+                      surface_figure, (var1, var2, matrix)))
+    return specs
+
+
+if __name__ == "__main__":
+    plt.rcParams.update(style())
+    for (_, function, args) in figures(load_dataset()):
+        function(*args)
+        plt.show()
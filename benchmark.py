@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""Headless benchmark of the stimulus renderer in runner.py.
+
+Plays every condition in LINE_LENGTHS x STIM_RADII x STIM_PERIODS through
+start_trial() and update_stimulus() for each number of lines, and reports
+frames/s, per-frame latency and memory allocated per frame. Uses a stub
+canvas by default, so no display is needed; pass --tk to draw on a real
+canvas instead (e.g. under xvfb-run), and --no-batch to move each line
+with its own call instead of runner.BATCH_UPDATES' single set_coords call.
+
+Usage: python benchmark.py [--n-stim 60 250 1000] [--frames 50] [--tk]
+       [--no-batch] [--max-p99 MS]
+"""
+
+import argparse
+import gc
+import sys
+import tracemalloc
+from time import perf_counter
+import numpy as np
+
+import geometry
+import headless
+import runner
+
+N_STIMS = (60, 125, 250, 500, 1000)
+
+
+def conditions() -> list:
+    """
+    Returns every trial condition of the levels in runner.py, with
+    runner.N_STIM lines.
+
+    Parameters
+    ----------
+    None taken.
+
+    Returns
+    -------
+    list[tuple] (line length, stim radius, stim period, line angle, number
+    of lines).
+    """
+    return [runner.condition((i, j, k))
+            for i in range(runner.N_LINE_LENGTHS)
+            for j in range(runner.N_STIM_RADII)
+            for k in range(runner.N_STIM_PERIODS)]
+
+
+def play(n_frames: int) -> np.array:
+    """
+    Play the current trial for n_frames frames as fast as possible.
+
+    Parameters
+    ----------
+    n_frames: int number of frames to draw.
+
+    Returns
+    -------
+    np.array time taken by each update_stimulus() call, in seconds.
+    """
+    times = np.empty(n_frames)
+    for f in range(n_frames):
+        runner.frame_count = f
+        t = perf_counter()
+        runner.update_stimulus()
+        times[f] = perf_counter() - t
+    return times
+
+
+def measure_allocs(n_frames: int) -> float:
+    """
+    Measure the memory allocated per update_stimulus() call. Only the peak
+    above what was already allocated is counted, so this includes
+    temporaries that are freed before the next frame.
+
+    Parameters
+    ----------
+    n_frames: int number of frames to average over.
+
+    Returns
+    -------
+    float mean bytes allocated per frame.
+    """
+    tracemalloc.start()
+    total = 0
+    for f in range(n_frames):
+        runner.frame_count = f
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        runner.update_stimulus()
+        total += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return total / n_frames
+
+
+def bench(n_stim: int, n_frames: int) -> dict:
+    """
+    Run every condition with n_stim lines.
+
+    Parameters
+    ----------
+    n_stim: int number of lines in the stimulus.
+    n_frames: int frames to play per condition.
+
+    Returns
+    -------
+    dict summary statistics; times are in ms.
+    """
+    runner.N_STIM = n_stim
+    runner.trials = conditions()
+    geometry.clear_cache()
+    setup = []
+    times = []
+    allocs = []
+    gc.collect()
+    for trial in range(len(runner.trials)):
+        runner.trial = trial
+        t = perf_counter()
+        runner.start_trial()
+        setup.append(perf_counter() - t)
+        times.append(play(n_frames))
+        if trial % runner.N_STIM_PERIODS == 0:
+            allocs.append(measure_allocs(min(n_frames, 10)))
+        runner.stop_trial()
+    times = np.concatenate(times)
+    return {
+        "n_stim": n_stim,
+        "fps": len(times) / times.sum(),
+        "p50": np.percentile(times, 50) * 1000,
+        "p99": np.percentile(times, 99) * 1000,
+        "setup": np.mean(setup) * 1000,
+        "alloc": np.mean(allocs) / 1024
+    }
+
+
+def main() -> None:
+    """
+    Entry point. Parses arguments and prints one row per number of lines.
+
+    Parameters
+    ----------
+    None taken.
+
+    Returns
+    -------
+    None.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--n-stim", type=int, nargs="+", default=N_STIMS,
+                        help="numbers of lines to benchmark")
+    parser.add_argument("--frames", type=int,
+                        default=int(runner.PLAY_LENGTH
+                                    * runner.UPDATES_PER_SECOND) + 1,
+                        help="frames to play per condition")
+    parser.add_argument("--tk", action="store_true",
+                        help="draw on a real Tk canvas (needs a display)")
+    parser.add_argument("--no-batch", action="store_true",
+                        help="move each line with its own canvas call")
+    parser.add_argument("--max-p99", type=float,
+                        help="exit with an error if any p99 latency (ms) is"
+                        + " above this")
+    args = parser.parse_args()
+
+    canvas = None
+    if args.tk:
+        from tkinter import Canvas, Tk
+        window = Tk()
+        window.geometry("1920x1012")
+        canvas = Canvas(window, bg="white", highlightthickness=0,
+                        width=1920, height=1012)
+        canvas.pack()
+        window.update()
+    headless.install(runner, canvas)
+    runner.BATCH_UPDATES = not args.no_batch
+    runner.state = runner.STATE_PLAY
+
+    print("n_stim  frames/s  p50 (ms)  p99 (ms)  setup (ms)"
+          + "  alloc (KiB/frame)")
+    slow = False
+    for n_stim in args.n_stim:
+        row = bench(n_stim, args.frames)
+        print("{n_stim:6d}  {fps:8.0f}  {p50:8.3f}  {p99:8.3f}  {setup:10.2f}"
+              "  {alloc:17.2f}".format(**row), flush=True)
+        if args.max_p99 is not None and row["p99"] > args.max_p99:
+            slow = True
+    if slow:
+        sys.exit("p99 latency above " + str(args.max_p99) + " ms")
+
+
+if __name__ == "__main__":
+    main()
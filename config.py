@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+"""Experiment definitions loaded from JSON files.
+
+A definition overrides any of the constants at the top of runner.py, e.g.
+
+    {
+        "factors": {"line_length": [30, 60, 90], "line_angle": [45]},
+        "reps": 2,
+        "blocks": 4,
+        "timing": {"play_length": 3.0, "updates_per_second": 100},
+        "stimulus": {"max_displacement": 100, "line_width": 5,
+                     "shape": "line", "shape_params": []},
+        "adaptive": {"enabled": false, "trials": 125, "target_sd": null},
+        "script": "script.txt"
+    }
+
+Every key is optional. Each block is the full factorial of the factors,
+repeated reps times, unless "conditions" lists the block's conditions
+explicitly (e.g. [{"line_length": 150, "line_angle": 8}, ...]; factors left
+out take their first level). Texts come from a script file like
+script.txt, and "texts" can override single ones, e.g. {"rest_text": ...}.
+
+A definition is validated once and compiled into a plan: the constants for
+runner.py and the trajectory table of every condition. Plans are saved in
+.plans/ by the hash of what they were compiled from, so relaunching the
+same protocol loads the plan instead of building it.
+"""
+
+from itertools import product
+import hashlib
+import json
+import os
+import pickle
+from numbers import Real
+import numpy as np
+
+import geometry
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PLAN_DIR = os.path.join(HERE, ".plans")
+# bump to invalidate every plan compiled by an older version of this module
+PLAN_VERSION: int = 1
+
+# parameters of a condition, in the order of runner.py's trial tuples
+FACTORS = ("line_length", "stim_radius", "stim_period", "line_angle",
+           "n_stim")
+# runner.py's level tuple of each factor, and the constant holding its
+# number of levels. line_angle and n_stim are single constants
+LEVEL_CONSTANTS = {
+    "line_length": ("LINE_LENGTHS", "N_LINE_LENGTHS"),
+    "stim_radius": ("STIM_RADII", "N_STIM_RADII"),
+    "stim_period": ("STIM_PERIODS", "N_STIM_PERIODS"),
+}
+# sections of a script file, in order, and the runner.py constants they set
+TEXTS = ("intro_text", "intro_text2", "intro_text3", "prac_intro_text",
+         "exp_intro_text", "rest_text", "end_text", "next_prompt",
+         "rate_prompt")
+# keys of each section of a definition, and the runner.py constants they
+# set
+SECTIONS = {
+    "timing": {"play_length": "PLAY_LENGTH",
+               "updates_per_second": "UPDATES_PER_SECOND"},
+    "stimulus": {"max_displacement": "MAX_DISPLACEMENT",
+                 "line_width": "LINE_WIDTH", "shape": "STIM_SHAPE",
+                 "shape_params": "SHAPE_PARAMS"},
+    "adaptive": {"enabled": "ADAPTIVE", "trials": "ADAPTIVE_TRIALS",
+                 "target_sd": "ADAPTIVE_TARGET_SD"},
+}
+KEYS = ("factors", "reps", "conditions", "blocks", "script", "texts")\
+    + tuple(SECTIONS)
+
+
+def read_script(path: str) -> dict:
+    """
+    Read the texts shown during the experiment from a script file, whose
+    sections are separated by "===".
+
+    Parameters
+    ----------
+    path: str path of the file.
+
+    Returns
+    -------
+    dict[str, str] each of TEXTS.
+    """
+    with open(path, "r") as f:
+        sections = f.read().split("===")
+    if len(sections) != len(TEXTS):
+        raise ValueError(path + ": expected " + str(len(TEXTS))
+                         + " sections separated by ===, found "
+                         + str(len(sections)))
+    return dict(zip(TEXTS, sections))
+
+
+def check_factor(factor: str, value, errors: list, where: str) -> None:
+    """
+    Check one value of a factor, adding a message to errors if it is not
+    valid.
+
+    Parameters
+    ----------
+    factor: str one of FACTORS.
+    value: the value.
+    errors: list[str] messages to add to.
+    where: str where the value is in the definition, for the message.
+
+    Returns
+    -------
+    None.
+    """
+    if isinstance(value, bool) or not isinstance(value, Real):
+        errors.append(where + ": not a number: " + repr(value))
+    elif factor == "n_stim" and (value != int(value) or value < 1):
+        errors.append(where + ": must be a whole number of lines")
+    elif factor == "stim_period" and value < 2:
+        errors.append(where + ": must be at least 2 frames")
+    elif factor in ("line_length", "stim_radius") and value <= 0:
+        errors.append(where + ": must be positive")
+
+
+def validate(experiment: dict) -> None:
+    """
+    Check an experiment definition, raising one error listing everything
+    wrong with it.
+
+    Parameters
+    ----------
+    experiment: dict the definition, as read from JSON.
+
+    Returns
+    -------
+    None.
+    """
+    errors = []
+    for key in experiment:
+        if key not in KEYS:
+            errors.append("unknown key: " + key)
+
+    factors = experiment.get("factors", {})
+    if not isinstance(factors, dict):
+        errors.append("factors: must be an object")
+        factors = {}
+    for (factor, levels) in factors.items():
+        if factor not in FACTORS:
+            errors.append("factors: unknown factor: " + factor)
+        elif not isinstance(levels, list) or not levels:
+            errors.append("factors." + factor + ": must be a non-empty list")
+        else:
+            for (i, value) in enumerate(levels):
+                check_factor(factor, value, errors,
+                             "factors." + factor + "[" + str(i) + "]")
+
+    conditions = experiment.get("conditions")
+    if conditions is not None:
+        if not isinstance(conditions, list) or not conditions:
+            errors.append("conditions: must be a non-empty list")
+            conditions = []
+        for (i, c) in enumerate(conditions):
+            where = "conditions[" + str(i) + "]"
+            if not isinstance(c, dict):
+                errors.append(where + ": must be an object")
+                continue
+            for (factor, value) in c.items():
+                if factor not in FACTORS:
+                    errors.append(where + ": unknown factor: " + factor)
+                else:
+                    check_factor(factor, value, errors,
+                                 where + "." + factor)
+
+    for (key, low) in (("reps", 1), ("blocks", 2)):
+        value = experiment.get(key, low)
+        if isinstance(value, bool) or not isinstance(value, int)\
+                or value < low:
+            errors.append(key + ": must be a whole number, at least "
+                          + str(low))
+
+    for (section, keys) in SECTIONS.items():
+        values = experiment.get(section, {})
+        if not isinstance(values, dict):
+            errors.append(section + ": must be an object")
+            continue
+        for key in values:
+            if key not in keys:
+                errors.append(section + ": unknown key: " + key)
+    timing = experiment.get("timing", {})
+    stimulus = experiment.get("stimulus", {})
+    adaptive = experiment.get("adaptive", {})
+    if isinstance(timing, dict):
+        if "play_length" in timing and not (
+                isinstance(timing["play_length"], Real)
+                and timing["play_length"] > 0):
+            errors.append("timing.play_length: must be a positive number")
+        if "updates_per_second" in timing and not (
+                isinstance(timing["updates_per_second"], int)
+                and timing["updates_per_second"] > 0):
+            errors.append("timing.updates_per_second: must be a positive"
+                          + " whole number")
+    if isinstance(stimulus, dict):
+        shape = stimulus.get("shape", "line")
+        shape_params = stimulus.get("shape_params", [])
+        if shape not in geometry.SHAPES:
+            errors.append("stimulus.shape: must be one of "
+                          + ", ".join(geometry.SHAPES))
+        elif not isinstance(shape_params, list):
+            errors.append("stimulus.shape_params: must be a list")
+        else:
+            # build the shape once, at unit length, so that bad parameters
+            # are reported here rather than once the window is up
+            try:
+                vertices = np.asarray(geometry.SHAPES[shape](
+                    1.0, *hashable(shape_params)), dtype=float)
+            except Exception as e:
+                errors.append("stimulus.shape_params: not valid for "
+                              + shape + ": " + repr(e))
+            else:
+                if vertices.ndim != 2 or vertices.shape[1] != 2\
+                        or len(vertices) < 2\
+                        or not np.isfinite(vertices).all():
+                    errors.append("stimulus.shape_params: " + shape
+                                  + " must give at least 2 finite"
+                                  + " (along, across) vertices")
+        for key in ("max_displacement", "line_width"):
+            if key in stimulus and not (isinstance(stimulus[key], Real)
+                                        and stimulus[key] >= 0):
+                errors.append("stimulus." + key + ": must be a number >= 0")
+    if isinstance(adaptive, dict):
+        if not isinstance(adaptive.get("enabled", False), bool):
+            errors.append("adaptive.enabled: must be true or false")
+        trials = adaptive.get("trials", 1)
+        if isinstance(trials, bool) or not isinstance(trials, int)\
+                or trials < 1:
+            errors.append("adaptive.trials: must be a whole number, at"
+                          + " least 1")
+        target = adaptive.get("target_sd")
+        if target is not None and not (isinstance(target, Real)
+                                       and target > 0):
+            errors.append("adaptive.target_sd: must be a positive number"
+                          + " or null")
+        if adaptive.get("enabled", False):
+            # the adaptive design only chooses from the grid of levels
+            if conditions is not None:
+                errors.append("adaptive: cannot be used with conditions")
+            for factor in ("line_angle", "n_stim"):
+                if len(factors.get(factor, [None])) != 1:
+                    errors.append("adaptive: factors." + factor
+                                  + " must have one level")
+
+    texts = experiment.get("texts", {})
+    if not isinstance(texts, dict):
+        errors.append("texts: must be an object")
+    else:
+        for (key, value) in texts.items():
+            if key not in TEXTS:
+                errors.append("texts: unknown text: " + key)
+            elif not isinstance(value, str):
+                errors.append("texts." + key + ": must be a string")
+    if "script" in experiment and not isinstance(experiment["script"], str):
+        errors.append("script: must be a path")
+
+    if errors:
+        raise ValueError("invalid experiment definition:\n  "
+                         + "\n  ".join(errors))
+
+
+def load_config(path: str) -> dict:
+    """
+    Read and validate an experiment definition. The texts are read from its
+    script file (if any) into "texts".
+
+    Parameters
+    ----------
+    path: str path of the JSON file.
+
+    Returns
+    -------
+    dict the definition.
+    """
+    with open(path, "r") as f:
+        experiment = json.load(f)
+    if not isinstance(experiment, dict):
+        raise ValueError(path + ": must contain a JSON object")
+    validate(experiment)
+    texts = {}
+    if "script" in experiment:
+        # relative to the definition, not the working directory
+        texts = read_script(os.path.join(os.path.dirname(path),
+                                         experiment["script"]))
+    texts.update(experiment.get("texts", {}))
+    experiment["texts"] = texts
+    return experiment
+
+
+def hashable(value):
+    """
+    Convert lists from JSON (including nested ones) to tuples.
+
+    Parameters
+    ----------
+    value: the value.
+
+    Returns
+    -------
+    the value, with every list replaced by a tuple.
+    """
+    if isinstance(value, list):
+        return tuple(hashable(x) for x in value)
+    return value
+
+
+def constants(experiment: dict, current: dict) -> dict:
+    """
+    Compile a definition into the runner.py constants it sets.
+
+    Parameters
+    ----------
+    experiment: dict the definition, from load_config().
+    current: dict runner.py's current globals, for everything the
+    definition leaves out.
+
+    Returns
+    -------
+    dict[str, object] name and value of each constant to set.
+    """
+    values = {}
+    levels = {}
+    for factor in FACTORS:
+        if factor in LEVEL_CONSTANTS:
+            default = current[LEVEL_CONSTANTS[factor][0]]
+        else:
+            default = (current[factor.upper()],)
+        levels[factor] = tuple(experiment.get("factors", {})
+                               .get(factor, default))
+    for (factor, (name, count)) in LEVEL_CONSTANTS.items():
+        values[name] = levels[factor]
+        values[count] = len(levels[factor])
+    values["LINE_ANGLE"] = levels["line_angle"][0]
+    values["N_STIM"] = int(levels["n_stim"][0])
+
+    if experiment.get("conditions") is not None:
+        block = [tuple(c.get(factor, levels[factor][0])
+                       for factor in FACTORS)
+                 for c in experiment["conditions"]]
+    else:
+        block = list(product(*[levels[factor] for factor in FACTORS]))\
+            * experiment.get("reps", 1)
+    values["BLOCK_CONDITIONS"] = [c[:4] + (int(c[4]),) for c in block]
+    values["N_TRIALS"] = len(block)
+    values["N_BLOCKS"] = experiment.get("blocks", current["N_BLOCKS"])
+
+    # everything the geometry depends on is set, so that it is in the hash
+    # of the plan even where the definition leaves it out
+    current = dict(current, ADAPTIVE_TRIALS=values["N_TRIALS"])
+    for (section, keys) in SECTIONS.items():
+        for (key, name) in keys.items():
+            values[name] = hashable(experiment.get(section, {})
+                                    .get(key, current[name]))
+    for (key, text) in experiment.get("texts", {}).items():
+        values[key.upper()] = text
+    return values
+
+
+def plan_path(values: dict) -> str:
+    """
+    Returns the path of the plan compiled from some constants.
+
+    Parameters
+    ----------
+    values: dict the constants, from constants().
+
+    Returns
+    -------
+    str path of the plan file (which may not exist yet).
+    """
+    digest = hashlib.sha1(repr((
+        PLAN_VERSION, geometry.LENGTH_QUANTUM, geometry.ANGLE_QUANTUM,
+        sorted(values.items()))).encode()).hexdigest()
+    return os.path.join(PLAN_DIR, digest + ".pkl")
+
+
+def save_plan(path: str, plan: dict) -> None:
+    """
+    Save a plan, replacing any old one atomically.
+
+    Parameters
+    ----------
+    path: str path of the plan file.
+    plan: dict the plan.
+
+    Returns
+    -------
+    None.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # several processes (e.g. simulate.py's) may compile the same plan at
+    # once
+    tmp_path = path + "." + str(os.getpid()) + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(plan, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def load_plan(experiment: dict, current: dict) -> dict:
+    """
+    Load the plan of a definition, compiling it if it has not been yet.
+
+    Parameters
+    ----------
+    experiment: dict the definition, from load_config().
+    current: dict runner.py's current globals.
+
+    Returns
+    -------
+    dict the plan: "constants", the runner.py constants to set;
+    "tables", the trajectory tables compiled so far, for each stimulus
+    center; and "path", where it is saved.
+    """
+    values = constants(experiment, current)
+    path = plan_path(values)
+    try:
+        with open(path, "rb") as f:
+            plan = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        plan = {"constants": values, "tables": {}}
+        save_plan(path, plan)
+    plan["path"] = path
+    return plan
+
+
+def load_geometry(plan: dict, center: tuple) -> None:
+    """
+    Fill the trajectory cache with the table of every condition of a plan,
+    computing (and saving) them only if the plan has none for this center.
+
+    Parameters
+    ----------
+    plan: dict the plan, from load_plan().
+    center: tuple[float, float] center of the stimulus on this screen.
+
+    Returns
+    -------
+    None.
+    """
+    center = tuple(center)
+    values = plan["constants"]
+    tables = plan["tables"].get(center)
+    if tables is None:
+        tables = {}
+        for c in set(values["BLOCK_CONDITIONS"]):
+            args = (center, c[4], c[3], c[0], c[1], c[2],
+                    values["MAX_DISPLACEMENT"], values["STIM_SHAPE"],
+                    values["SHAPE_PARAMS"])
+            tables[geometry.trajectory_key(*args)] =\
+                geometry.trajectory(*args)
+        plan["tables"][center] = tables
+        save_plan(plan["path"], {"constants": plan["constants"],
+                                 "tables": plan["tables"]})
+    for (key, table) in tables.items():
+        # unpickled arrays are writeable again
+        table.setflags(write=False)
+        geometry.store(key, table)
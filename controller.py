@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""Runs sessions on several stations from one place.
+
+Each station is a runner.py started with --controller HOST:PORT. When a
+session starts, the controller assigns it the next of a set of
+counterbalanced trial orders: every block is a row of a Williams design
+over the conditions of a block, so across sessions each condition is shown
+equally often at each position and directly after each other condition.
+Results are streamed back as they are recorded (see station.py) and
+appended to the session's files in the controller's data directory,
+data/merged/ by default, in the same format as a station's data/ (pass it
+to analysis/dataset.py's load_dataset() to analyze them). It cannot be
+data/ itself, since a station running from the same directory would save
+every result there twice.
+
+Stations should run the same experiment definition (--config) as the
+controller, since only the trial order is sent to them.
+
+Usage: python controller.py [--host 0.0.0.0] [--port 8765] [--config PATH]
+       [--data data/merged]
+"""
+
+from argparse import ArgumentParser
+import asyncio
+import json
+import os
+import numpy as np
+
+import config
+import runner
+import station
+import storage
+
+PORT: int = 8765
+# directory results are merged into. separate from data/, where runner.py
+# saves each station's own results
+DATA_DIR: str = os.path.join("data", "merged")
+# file in the data directory holding the number of orders assigned so far,
+# so that counterbalancing carries on where it left off after a restart
+STATE_FILE = "controller.json"
+
+
+def williams(n: int) -> np.array:
+    """
+    Build a Williams design: orders of n conditions, balanced for first-order
+    carryover.
+
+    Parameters
+    ----------
+    n: int number of conditions.
+
+    Returns
+    -------
+    np.array (n for even n, else 2n, n) int; each row is an order of the
+    condition indices.
+    """
+    # 0, 1, n-1, 2, n-2, ...
+    first = np.zeros(n, dtype=int)
+    first[1::2] = np.arange(1, n // 2 + 1)[:len(first[1::2])]
+    first[2::2] = (n - np.arange(1, n // 2 + 1))[:len(first[2::2])]
+    rows = (first + np.arange(n)[:, np.newaxis]) % n
+    if n % 2 == 1:
+        rows = np.concatenate([rows, rows[:, ::-1]])
+    return rows
+
+
+class Controller:
+    """
+    Assigns trial orders to sessions and merges their results.
+    """
+
+    def __init__(self, block: list, n_blocks: int,
+                 data_dir: str = DATA_DIR) -> None:
+        """
+        Parameters
+        ----------
+        block: list[tuple] conditions of each block, as
+        runner.BLOCK_CONDITIONS.
+        n_blocks: int blocks in a session, including the practice block.
+        data_dir: str directory to merge the results into.
+        """
+        self.block = [list(c) for c in block]
+        self.n_blocks = n_blocks
+        self.data_dir = data_dir
+        self.orders = williams(len(block))
+        self.state_path = os.path.join(data_dir, STATE_FILE)
+        try:
+            self.next_order = storage.load_checkpoint(
+                self.state_path)["next_order"]
+        except (OSError, ValueError, KeyError):
+            self.next_order = 0
+        # files are written on their own thread, off the event loop
+        self.io_thread = storage.WriterThread()
+        self.writers = {}  # dict[str, storage.TrialWriter]
+        self.received = {}  # dict[str, int] results merged, by session
+        self.stations = {}  # dict[str, str] station running each session
+
+    def trials(self, order: int) -> list:
+        """
+        Returns the trials of a session.
+
+        Parameters
+        ----------
+        order: int which of the counterbalanced orders to use.
+
+        Returns
+        -------
+        list[list] the conditions of every trial.
+        """
+        trials = []
+        for b in range(self.n_blocks):
+            row = self.orders[(order * self.n_blocks + b) % len(self.orders)]
+            trials += [self.block[i] for i in row]
+        return trials
+
+    def hello(self, message: dict) -> dict:
+        """
+        Register a session.
+
+        Parameters
+        ----------
+        message: dict the station's hello (see station.py).
+
+        Returns
+        -------
+        dict the answer.
+        """
+        session = os.path.basename(message["session"])
+        self.stations[session] = message["station"]
+        if session not in self.received:
+            path = os.path.join(self.data_dir, session + ".trials")
+            self.received[session] = os.path.getsize(path)\
+                // storage.RECORD_DTYPE.itemsize if os.path.exists(path)\
+                else 0
+        if message.get("resume"):
+            print(message["station"] + ": resumed " + session, flush=True)
+            return {"type": "resume", "received": self.received[session]}
+        order = self.next_order
+        self.next_order += 1
+        self.io_thread.submit(storage.save_checkpoint, self.state_path,
+                              {"next_order": self.next_order})
+        print(message["station"] + ": started " + session + " with order "
+              + str(order), flush=True)
+        return {"type": "order", "order": order, "trials": self.trials(order)}
+
+    def result(self, message: dict) -> None:
+        """
+        Merge one trial's results. Results already merged (sent again after
+        a resume) are ignored.
+
+        Parameters
+        ----------
+        message: dict the station's result (see station.py).
+
+        Returns
+        -------
+        None.
+        """
+        session = os.path.basename(message["session"])
+        record = tuple(message["record"])
+        if record[0] < self.received.get(session, 0):
+            return
+        if session not in self.writers:
+            self.writers[session] = storage.TrialWriter(
+                os.path.join(self.data_dir, session))
+        self.io_thread.submit(self.writers[session].append, record)
+        self.received[session] = record[0] + 1
+
+    def end(self, session: str, complete: bool) -> None:
+        """
+        Close a session's files.
+
+        Parameters
+        ----------
+        session: str name of the session.
+        complete: bool whether it finished, in which case its results are
+        renamed to .csv for the analysis scripts.
+
+        Returns
+        -------
+        None.
+        """
+        writer = self.writers.pop(session, None)
+        if writer is not None:
+            self.io_thread.submit(writer.close, complete)
+        if session in self.stations:
+            print(self.stations[session] + ": "
+                  + ("finished " if complete else "stopped ") + session
+                  + " (" + str(self.received[session]) + " results)",
+                  flush=True)
+
+    async def handle(self, reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter) -> None:
+        """
+        Serve one station's connection until it closes.
+
+        Parameters
+        ----------
+        reader: asyncio.StreamReader the connection's input.
+        writer: asyncio.StreamWriter the connection's output.
+
+        Returns
+        -------
+        None.
+        """
+        sessions = set()
+        try:
+            async for line in reader:
+                message = json.loads(line)
+                kind = message["type"]
+                if kind == "hello":
+                    sessions.add(os.path.basename(message["session"]))
+                    writer.write(station.encode(self.hello(message)))
+                    await writer.drain()
+                elif kind == "result":
+                    self.result(message)
+                elif kind == "end":
+                    session = os.path.basename(message["session"])
+                    sessions.discard(session)
+                    self.end(session, message["complete"])
+        except (ConnectionError, ValueError, KeyError) as e:
+            print("bad connection: " + repr(e), flush=True)
+        finally:
+            # sessions that went away without saying so are left as
+            # .csv.part, to be finished if they are resumed
+            for session in sessions:
+                self.end(session, False)
+            writer.close()
+
+    async def serve(self, host: str, port: int) -> None:
+        """
+        Accept stations until cancelled.
+
+        Parameters
+        ----------
+        host: str address to listen on.
+        port: int port to listen on.
+
+        Returns
+        -------
+        None.
+        """
+        os.makedirs(self.data_dir, exist_ok=True)
+        self.io_thread.start()
+        server = await asyncio.start_server(self.handle, host, port)
+        print("Listening on " + ", ".join(
+            "%s:%d" % s.getsockname()[:2] for s in server.sockets),
+            flush=True)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for session in list(self.writers):
+                self.end(session, False)
+            self.io_thread.close()
+
+
+def main() -> None:
+    """
+    Entry point. Parses arguments and serves stations until interrupted.
+
+    Parameters
+    ----------
+    None taken.
+
+    Returns
+    -------
+    None.
+    """
+    parser = ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="address to listen on; 0.0.0.0 for every"
+                        + " network")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--config", metavar="PATH",
+                        help="experiment definition the stations run (see"
+                        + " config.py)")
+    parser.add_argument("--data", default=DATA_DIR,
+                        help="directory to merge the results into")
+    args = parser.parse_args()
+    # runner.py saves to data/ under the directory it is started from,
+    # usually this checkout
+    station_dirs = {os.path.realpath("data"), os.path.realpath(os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "data"))}
+    if os.path.realpath(args.data) in station_dirs:
+        parser.error("--data cannot be a station's own data directory ("
+                     + args.data + "); results would be saved there twice")
+
+    experiment = config.load_config(args.config) if args.config else {}
+    values = config.constants(experiment, vars(runner))
+    controller = Controller(values["BLOCK_CONDITIONS"], values["N_BLOCKS"],
+                            args.data)
+    try:
+        asyncio.run(controller.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""Render every trial condition offline, frame by frame.
+
+Each condition is written to the output directory as a raw (frames, height,
+width) uint8 stack (.npy, loadable with np.load(..., mmap_mode="r")), or as
+a lossless video with --video if ffmpeg is installed. Frames are rendered at
+the display's refresh rate from the same geometry as runner.py, so playback
+timing no longer depends on how fast Tk can draw. Conditions are rendered in
+parallel, and each frame is written to disk as soon as it is drawn.
+
+Usage: python export.py [--out frames] [--fps 120] [--jobs N] [--video]
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import os
+import shutil
+import subprocess
+import numpy as np
+
+import geometry
+import runner
+import sprites
+
+
+def condition_frames(condition: tuple, size: tuple, fps: float,
+                     length: float) -> np.array:
+    """
+    Compute the vertices of every line at every output frame of a condition.
+
+    Parameters
+    ----------
+    condition: tuple[int, int, int] line length, stim radius, stim period.
+    size: tuple[int, int] width and height of the frames, in px.
+    fps: float refresh rate of the display the frames are for.
+    length: float length of the trial, in seconds.
+
+    Returns
+    -------
+    np.array (n_frames, N_STIM, 2 * number of vertices) array of vertices.
+    """
+    (line_length, stim_radius, stim_period) = condition
+    radial, offsets = geometry.stim_template(runner.N_STIM, runner.LINE_ANGLE,
+                                             line_length, runner.STIM_SHAPE,
+                                             runner.SHAPE_PARAMS)
+    base = geometry.stim_base((size[0] / 2, size[1] / 2), offsets)
+    # the period is in animation updates, not output frames
+    updates = np.arange(round(length * fps)) * runner.UPDATES_PER_SECOND / fps
+    radii = geometry.anim_radii(updates, stim_radius, stim_period,
+                                runner.MAX_DISPLACEMENT)
+    return base + radii[:, np.newaxis, np.newaxis] * radial
+
+
+def draw_fixation(image: np.array) -> None:
+    """
+    Draw the fixation cross at the center of a frame, as runner.py does.
+
+    Parameters
+    ----------
+    image: np.array frame to draw on.
+
+    Returns
+    -------
+    None.
+    """
+    (y, x) = (image.shape[0] // 2, image.shape[1] // 2)
+    image[y - 3:y + 3, x - 10:x + 10] = 0
+    image[y - 10:y + 10, x - 3:x + 3] = 0
+
+
+def export(condition: tuple, out: str, size: tuple, fps: float,
+           video: bool) -> str:
+    """
+    Render one condition and stream its frames to a file.
+
+    Parameters
+    ----------
+    condition: tuple[int, int, int] line length, stim radius, stim period.
+    out: str directory to write to.
+    size: tuple[int, int] width and height of the frames, in px.
+    fps: float refresh rate of the display the frames are for.
+    video: bool whether to encode a video with ffmpeg instead of an .npy.
+
+    Returns
+    -------
+    str path of the file written.
+    """
+    table = condition_frames(condition, size, fps, runner.PLAY_LENGTH)
+    name = os.path.join(out, "-".join([str(x) for x in condition]))
+    shape = (size[1], size[0])
+    image = np.empty(shape, dtype=np.uint8)
+
+    if video:
+        path = name + ".mkv"
+        encoder = subprocess.Popen(
+            ["ffmpeg", "-loglevel", "error", "-y", "-f", "rawvideo",
+             "-pix_fmt", "gray", "-s", "%dx%d" % size, "-r", str(fps),
+             "-i", "-", "-c:v", "ffv1", path],
+            stdin=subprocess.PIPE)
+    else:
+        path = name + ".npy"
+        stack = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8,
+                                          shape=(len(table),) + shape)
+
+    for (f, coords) in enumerate(table):
+        image.fill(255)
+        sprites.rasterize(coords, shape, runner.LINE_WIDTH, out=image)
+        draw_fixation(image)
+        if video:
+            encoder.stdin.write(image.tobytes())
+        else:
+            stack[f] = image
+
+    if video:
+        encoder.stdin.close()
+        if encoder.wait() != 0:
+            raise RuntimeError("ffmpeg failed on " + path)
+    else:
+        stack.flush()
+        del stack
+    return path
+
+
+def main() -> None:
+    """
+    Entry point. Parses arguments and renders all conditions.
+
+    Parameters
+    ----------
+    None taken.
+
+    Returns
+    -------
+    None.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--out", default="frames",
+                        help="directory to write to")
+    parser.add_argument("--fps", type=float, default=120,
+                        help="refresh rate of the display")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(),
+                        help="number of processes")
+    parser.add_argument("--video", action="store_true",
+                        help="encode lossless .mkv videos with ffmpeg")
+    args = parser.parse_args()
+    if args.video and shutil.which("ffmpeg") is None:
+        parser.error("--video needs ffmpeg on the PATH")
+
+    os.makedirs(args.out, exist_ok=True)
+    conditions = [(l, r, p) for l in runner.LINE_LENGTHS
+                  for r in runner.STIM_RADII for p in runner.STIM_PERIODS]
+    with ProcessPoolExecutor(args.jobs) as pool:
+        jobs = [pool.submit(export, c, args.out, (args.width, args.height),
+                            args.fps, args.video) for c in conditions]
+        for job in jobs:
+            print(job.result(), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""Vectorized geometry for the rotating tilted lines stimulus."""
+
+from collections import OrderedDict
+from math import pi
+import threading
+import numpy as np
+
+# memory available for caching trajectory tables, in bytes
+TRAJECTORY_CACHE_BYTES: int = 256 << 20
+
+# resolution of the trajectory cache keys: conditions closer than this are
+# drawn from the same table. lengths (line length and stim radius) are in
+# px, angles in degrees; periods are always whole frames
+LENGTH_QUANTUM: float = 0.5
+ANGLE_QUANTUM: float = 0.1
+
+# least recently used first
+cache = OrderedDict()
+# total size of the tables in the cache, in bytes
+cache_bytes: int = 0
+# held while using the cache: sprites are rendered on a worker thread
+cache_lock = threading.RLock()
+
+
+def line_shape(line_length: float) -> np.array:
+    """
+    Vertices of a straight line, centered on its midpoint.
+
+    Parameters
+    ----------
+    line_length: float length of the line.
+
+    Returns
+    -------
+    np.array (2, 2) array of (along, across) coordinates.
+    """
+    return np.array(((-0.5 * line_length, 0), (0.5 * line_length, 0)))
+
+
+def arc_shape(line_length: float, curvature: float,
+              n_vertices: int = 16) -> np.array:
+    """
+    Vertices of a circular arc, centered on its midpoint.
+    The chord of the arc lies along the line direction.
+
+    Parameters
+    ----------
+    line_length: float length of the arc (along the curve).
+    curvature: float 1 / radius of the arc. The sign sets which way it
+    bends.
+    n_vertices: int number of vertices to approximate the arc with.
+
+    Returns
+    -------
+    np.array (n_vertices, 2) array of (along, across) coordinates.
+    """
+    s = np.linspace(-0.5, 0.5, n_vertices) * line_length
+    if curvature == 0:
+        return np.column_stack((s, np.zeros(n_vertices)))
+    phi = s * curvature
+    # shift so that the midpoint of the arc is at the origin
+    return np.column_stack((np.sin(phi) / curvature,
+                            (np.cos(phi) - 1) / -curvature))
+
+
+def polyline_shape(line_length: float, points: tuple) -> np.array:
+    """
+    Vertices of an arbitrary polyline.
+
+    Parameters
+    ----------
+    line_length: float scale of the polyline.
+    points: tuple[tuple[float, float]] (along, across) coordinates of the
+    control points, in units of line_length.
+
+    Returns
+    -------
+    np.array (len(points), 2) array of (along, across) coordinates.
+    """
+    return np.array(points, dtype=float) * line_length
+
+
+# stimulus shape name -> function giving its vertices in the line's frame,
+# called as shape(line_length, *shape_params). e.g. shape_params is
+# (curvature, n_vertices) for "arc" and (points,) for "polyline".
+SHAPES: dict = {
+    "line": line_shape,
+    "arc": arc_shape,
+    "polyline": polyline_shape,
+}
+
+
+def quantize(n_stim: int, line_angle: float, line_length: float,
+             stim_radius: float, stim_period: float) -> tuple:
+    """
+    Round the parameters of a condition to the resolution of the trajectory
+    cache. Values that are already on the grid are returned unchanged (as
+    ints if they were ints).
+
+    Parameters
+    ----------
+    n_stim: int number of lines.
+    line_angle: float angle from radius to line, in degrees.
+    line_length: float length of each line.
+    stim_radius: float radius of the stimulus at rest.
+    stim_period: float frames per expansion and contraction.
+
+    Returns
+    -------
+    tuple[int, float, float, float, int] the rounded parameters, in the same
+    order.
+    """
+    def snap(value, quantum):
+        # the outer round drops float error, e.g. 333 * 0.1 = 33.300...04
+        snapped = round(round(value / quantum) * quantum, 9)
+        return int(snapped) if float(snapped).is_integer() else snapped
+    return (int(n_stim), snap(line_angle, ANGLE_QUANTUM),
+            snap(line_length, LENGTH_QUANTUM),
+            snap(stim_radius, LENGTH_QUANTUM),
+            max(2, int(round(stim_period))))
+
+
+def clear_cache() -> None:
+    """
+    Empty the trajectory cache.
+
+    Parameters
+    ----------
+    None taken.
+
+    Returns
+    -------
+    None.
+    """
+    global cache_bytes
+    with cache_lock:
+        cache.clear()
+        cache_bytes = 0
+
+
+def trajectory_key(center: tuple, n_stim: int, line_angle: float,
+                   line_length: float, stim_radius: float, stim_period: float,
+                   max_displacement: float, shape: str = "line",
+                   shape_params: tuple = ()) -> tuple:
+    """
+    Returns the key of a condition in the trajectory cache.
+
+    Parameters
+    ----------
+    Same as trajectory().
+
+    Returns
+    -------
+    tuple the center, the quantize()d parameters and the rest, in order.
+    """
+    return (tuple(center),) + quantize(n_stim, line_angle, line_length,
+                                       stim_radius, stim_period)\
+        + (max_displacement, shape, shape_params)
+
+
+def store(key: tuple, table: np.array) -> None:
+    """
+    Add a table to the trajectory cache, evicting the least recently used
+    tables to keep it within TRAJECTORY_CACHE_BYTES.
+
+    Parameters
+    ----------
+    key: tuple key of the table, from trajectory_key().
+    table: np.array the table, as trajectory() returns it.
+
+    Returns
+    -------
+    None.
+    """
+    global cache_bytes
+    with cache_lock:
+        if key in cache:
+            cache_bytes -= cache.pop(key).nbytes
+        while cache and cache_bytes + table.nbytes > TRAJECTORY_CACHE_BYTES:
+            cache_bytes -= cache.popitem(last=False)[1].nbytes
+        if table.nbytes <= TRAJECTORY_CACHE_BYTES:
+            cache[key] = table
+            cache_bytes += table.nbytes
+
+
+def stim_template(n_stim: int, line_angle: float, line_length: float,
+                  shape: str = "line", shape_params: tuple = ()) -> tuple:
+    """
+    Precompute the direction vectors and vertices of every line in the
+    stimulus. Only needs to be called once per trial.
+
+    Parameters
+    ----------
+    n_stim: int number of lines.
+    line_angle: float angle from radius to line, in degrees.
+    line_length: float length of each line.
+    shape: str name of the shape of each line, a key of SHAPES.
+    shape_params: tuple extra arguments to the shape function.
+
+    Returns
+    -------
+    tuple[np.array, np.array] unit radius vectors and vertex offsets from
+    the midpoint, both of shape (n_stim, 2 * n_vertices) and laid out as
+    (x0, y0, x1, y1, ...) so that they broadcast directly against the
+    endpoint array. For lines, that is (inner x, inner y, outer x, outer y).
+    """
+    template = SHAPES[shape](line_length, *shape_params)
+    theta = np.arange(n_stim) * (2 * pi / n_stim)
+    alpha = theta + line_angle * pi / 180
+    radial = np.column_stack((np.cos(theta), np.sin(theta)))
+    along = np.column_stack((np.cos(alpha), np.sin(alpha)))
+    across = np.column_stack((-np.sin(alpha), np.cos(alpha)))
+    # rotate the template into the frame of each line
+    offsets = template[:, 0, np.newaxis] * along[:, np.newaxis]\
+        + template[:, 1, np.newaxis] * across[:, np.newaxis]
+    return np.tile(radial, len(template)), offsets.reshape(n_stim, -1)
+
+
+def stim_base(center: tuple, offsets: np.array) -> np.array:
+    """
+    Anchor the vertex offsets of a template at the center of the screen.
+
+    Parameters
+    ----------
+    center: tuple[float, float] center of the stimulus.
+    offsets: np.array vertex offsets from stim_template().
+
+    Returns
+    -------
+    np.array vertices of the lines at radius 0, shape (n_stim, 2 * n_vertices).
+    """
+    return offsets + np.tile(center, offsets.shape[1] // 2)
+
+
+def stim_coords(base: np.array, radial: np.array, radius: float) -> np.array:
+    """
+    Returns the vertices of every line at the given stimulus radius.
+
+    Parameters
+    ----------
+    base: np.array vertices at radius 0 from stim_base().
+    radial: np.array unit radius vectors from stim_template().
+    radius: float radius of circle of lines (through midpoints).
+
+    Returns
+    -------
+    np.array vertices, shape (n_stim, 2 * n_vertices).
+    """
+    # (center of screen) + (radius vector) + (vertex offset)
+    return base + radius * radial
+
+
+def anim_radii(frames: np.array, stim_radius: float, stim_period: float,
+               max_displacement: float) -> np.array:
+    """
+    Returns the triangle-wave animation radius at each of the given frames.
+
+    Parameters
+    ----------
+    frames: np.array frame numbers since the start of the trial.
+    stim_radius: float radius of the stimulus at rest.
+    stim_period: float frames per expansion and contraction.
+    max_displacement: float maximum amount of dilation/contraction.
+
+    Returns
+    -------
+    np.array radius of circle of lines at each frame.
+    """
+    cur_frame = np.mod(frames, stim_period)
+    # expands for the first half period, contracts for the second
+    return stim_radius + (max_displacement * 2
+                          * np.minimum(cur_frame, stim_period - cur_frame)
+                          / stim_period)
+
+
+def trajectory(center: tuple, n_stim: int, line_angle: float,
+               line_length: float, stim_radius: float, stim_period: float,
+               max_displacement: float, shape: str = "line",
+               shape_params: tuple = ()) -> np.array:
+    """
+    Build the vertices of every line for one full period of the animation.
+    The parameters are rounded with quantize() first, and tables are cached
+    by the rounded condition, so each is only computed once per session.
+    The least recently used tables are evicted first to keep the cache
+    within TRAJECTORY_CACHE_BYTES.
+
+    Parameters
+    ----------
+    center: tuple[float, float] center of the stimulus.
+    n_stim: int number of lines.
+    line_angle: float angle from radius to line, in degrees.
+    line_length: float length of each line.
+    stim_radius: float radius of the stimulus at rest.
+    stim_period: float frames per expansion and contraction.
+    max_displacement: float maximum amount of dilation/contraction.
+    shape: str name of the shape of each line, a key of SHAPES.
+    shape_params: tuple extra arguments to the shape function. Must be
+    hashable.
+
+    Returns
+    -------
+    np.array read-only (stim_period, n_stim, 2 * n_vertices) array of
+    vertices, with stim_period rounded to whole frames; frame f of the
+    animation is at index f % stim_period.
+    """
+    key = trajectory_key(center, n_stim, line_angle, line_length,
+                         stim_radius, stim_period, max_displacement, shape,
+                         shape_params)
+    (_, n_stim, line_angle, line_length, stim_radius, stim_period) = key[:6]
+    with cache_lock:
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+
+    radial, offsets = stim_template(n_stim, line_angle, line_length, shape,
+                                    shape_params)
+    base = stim_base(center, offsets)
+    radii = anim_radii(np.arange(stim_period), stim_radius, stim_period,
+                       max_displacement)
+    table = base + radii[:, np.newaxis, np.newaxis] * radial
+    table.setflags(write=False)
+    store(key, table)
+    return table
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""Stand-ins for the tkinter widgets in runner.py, for running without a
+display."""
+
+import heapq
+
+
+class StubTcl:
+    """
+    Stands in for the Tcl interpreter behind a StubCanvas. Only understands
+    the set_coords procedure defined by runner.py.
+    """
+
+    def __init__(self, canvas) -> None:
+        self.canvas = canvas
+
+    def eval(self, _) -> str:
+        return ""
+
+    def call(self, proc: str, _, ids: list, stride: int,
+             coords: list) -> str:
+        if proc != "set_coords":
+            raise NotImplementedError(proc)
+        self.canvas.n_calls += 1
+        for (i, item) in enumerate(ids):
+            self.canvas.items[item] = coords[i * stride:(i + 1) * stride]
+        return ""
+
+
+class StubCanvas:
+    """
+    Records the calls runner.py makes to its Canvas instead of drawing.
+    """
+
+    _w = ".stub"
+
+    def __init__(self, width: int = 1920, height: int = 1012,
+                 clock=None) -> None:
+        """
+        Parameters
+        ----------
+        width: int width of the pretend canvas, in px.
+        height: int height of the pretend canvas, in px.
+        clock: VirtualClock to schedule after() calls on, or None if they
+        are not needed.
+        """
+        self.width = width
+        self.height = height
+        self.clock = clock
+        self.items = {}  # dict[int, list[float]]
+        self.tags = {}  # dict[int, list[str]]
+        self.n_items = 0
+        self.n_calls = 0
+        self.tk = StubTcl(self)
+
+    def _create(self, coords: tuple, tags: list) -> int:
+        self.n_calls += 1
+        self.n_items += 1
+        self.items[self.n_items] = list(coords)
+        self.tags[self.n_items] = list(tags)
+        return self.n_items
+
+    def create_line(self, *coords, tags: list = (), **_) -> int:
+        return self._create(coords, tags)
+
+    def create_rectangle(self, *coords, tags: list = (), **_) -> int:
+        return self._create(coords, tags)
+
+    def create_text(self, *coords, tags: list = (), **_) -> int:
+        return self._create(coords, tags)
+
+    def move(self, item: int, dx: float, dy: float) -> None:
+        self.n_calls += 1
+        c = self.items[item]
+        for i in range(0, len(c), 2):
+            c[i] += dx
+            c[i + 1] += dy
+
+    def coords(self, item: int, *coords) -> list:
+        self.n_calls += 1
+        if coords:
+            self.items[item] = list(coords)
+        return self.items[item]
+
+    def delete(self, tag: str) -> None:
+        self.n_calls += 1
+        for item in [i for (i, t) in self.tags.items() if tag in t]:
+            del self.items[item]
+            del self.tags[item]
+
+    def itemconfig(self, *_, **__) -> None:
+        self.n_calls += 1
+
+    itemconfigure = itemconfig
+
+    def winfo_height(self) -> int:
+        return self.height
+
+    def winfo_width(self) -> int:
+        return self.width
+
+    def after(self, ms: int, callback) -> None:
+        self.clock.after(ms, callback)
+
+
+class VirtualClock:
+    """
+    Stands in for the Tk event loop and perf_counter(), so that whatever is
+    scheduled runs as soon as everything before it has, with the time it
+    would have run at.
+    """
+
+    def __init__(self) -> None:
+        self.now = 0.0
+        self.events = []  # heap of (due time, sequence number, callback)
+        self.n_events = 0
+
+    def perf_counter(self) -> float:
+        return self.now
+
+    def after(self, ms: float, callback) -> None:
+        """
+        Schedule a call, as Tk's after().
+
+        Parameters
+        ----------
+        ms: float delay from now, in ms.
+        callback: callable function to call, with no arguments.
+
+        Returns
+        -------
+        None.
+        """
+        self.n_events += 1
+        heapq.heappush(self.events, (self.now + ms / 1000, self.n_events,
+                                     callback))
+
+    def run(self, done) -> None:
+        """
+        Run scheduled calls in order of time, moving the clock to each one's
+        time, until done() or nothing is scheduled.
+
+        Parameters
+        ----------
+        done: callable returning whether to stop, checked after every call.
+
+        Returns
+        -------
+        None.
+        """
+        while self.events and not done():
+            (due, _, callback) = heapq.heappop(self.events)
+            self.now = max(self.now, due)
+            callback()
+
+
+class StubVar:
+    """
+    Stands in for a tkinter IntVar/StringVar, or a Scale bound to one.
+    """
+
+    def __init__(self, value=0) -> None:
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def set(self, value) -> None:
+        self.value = value
+
+
+def install(runner, canvas=None, initials: str = "zz") -> None:
+    """
+    Point the widget globals of runner.py at stand-ins, as main() would.
+
+    Parameters
+    ----------
+    runner: module the imported runner module.
+    canvas: Canvas to draw on. Defaults to a new StubCanvas.
+    initials: str initials used to name saved files.
+
+    Returns
+    -------
+    None.
+    """
+    runner.canvas = StubCanvas() if canvas is None else canvas
+    runner.canvas.tk.eval(runner.SET_COORDS_PROC)
+    runner.screen_width = runner.canvas.winfo_width()
+    runner.screen_height = runner.canvas.winfo_height()
+    runner.slider_var = StubVar(0)
+    runner.slider = runner.slider_var
+    runner.initials_var = StubVar(initials)
+    runner.fixation = [
+        runner.canvas.create_rectangle(0, 0, 0, 0, tags=["fixation", "play"]),
+        runner.canvas.create_rectangle(0, 0, 0, 0, tags=["fixation", "play"])
+    ]
+    runner.text = runner.canvas.create_text(0, 0, tags=["start"])
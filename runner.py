@@ -6,12 +6,23 @@ __version__ = "2.1"
 __date__ = "25 Jul 2022"
 
 # IMPORTS #
+from argparse import ArgumentParser
 from datetime import datetime
-from math import pi, cos, sin
-from random import shuffle
+from math import ceil
+import os
+from random import Random, SystemRandom
+from time import perf_counter
+import traceback
 import numpy as np
 from tkinter import CENTER, HORIZONTAL, Button, Entry, Event, Frame, IntVar,\
-    Label, Scale, StringVar, Tk, Canvas, Toplevel, messagebox
+    Label, PhotoImage, Scale, StringVar, Tk, Canvas, Toplevel, messagebox
+
+import adaptive
+import config
+import geometry
+import sprites
+import station
+import storage
 
 # CONSTANTS #
 # relative weights (sizes) of menubar and canvas
@@ -26,10 +37,38 @@ N_STIM: int = 60
 # maximum amount of dilation/contraction
 MAX_DISPLACEMENT: int = 100
 LINE_WIDTH: int = 5
+# send each frame's line coords to Tk in one call instead of one per line
+BATCH_UPDATES: bool = True
+
+# sets the coords of many canvas items in a single round trip to Tcl.
+# coords is a flat list with stride numbers per item.
+SET_COORDS_PROC: str = """
+proc set_coords {canvas ids stride coords} {
+    set i 0
+    foreach id $ids {
+        $canvas coords $id [lrange $coords $i [expr {$i + $stride - 1}]]
+        incr i $stride
+    }
+}
+"""
+
+# play pre-rendered images of the stimulus instead of drawing lines
+SPRITE_MODE: bool = False
+# memory available for caching pre-rendered frames, in bytes, counted as Tk
+# holds them (4 bytes a pixel). must fit SPRITE_PREFETCH + 1 conditions
+SPRITE_CACHE_BYTES: int = 1 << 30
+# upcoming trials whose frames are rendered in the background while the
+# participant rates, rests or reads, so that trials start without waiting
+SPRITE_PREFETCH: int = 1
 
 # angle from radius to line
 LINE_ANGLE: int = 45  # controlled
 
+# shape of each line: a key of geometry.SHAPES, and the extra arguments to
+# its shape function. e.g. "arc", (0.01, 16) for arcs of curvature 0.01
+STIM_SHAPE: str = "line"
+SHAPE_PARAMS: tuple = ()
+
 LINE_LENGTHS = tuple(range(30, 180, 30))  # tuple[int]
 N_LINE_LENGTHS: int = len(LINE_LENGTHS)  # 5
 
@@ -39,23 +78,56 @@ N_STIM_RADII: int = len(STIM_RADII)  # 5
 STIM_PERIODS = (25, 50, 100, 150, 200)  # tuple[int]
 N_STIM_PERIODS: int = len(STIM_PERIODS)  # 5
 
-N_TRIALS: int = N_LINE_LENGTHS * N_STIM_RADII * N_STIM_PERIODS  # per block
+# conditions of each block as (line_length, stim_radius, stim_period,
+# line_angle, n_stim) tuples, all of which can take any value (geometry is
+# generated on demand). None for the full factorial of the levels above at
+# LINE_ANGLE and N_STIM. e.g. the old angle block, 8-80 deg 3 times each:
+# [(150, 250, 100, a, N_STIM) for a in range(8, 88, 8)] * 3
+BLOCK_CONDITIONS: list = None
+
+N_TRIALS: int = len(BLOCK_CONDITIONS) if BLOCK_CONDITIONS\
+    else N_LINE_LENGTHS * N_STIM_RADII * N_STIM_PERIODS  # per block
 N_BLOCKS: int = 4  # note that one of these is reserved as practice
 
 # trial length in seconds
-# NOTE: lab computer is slower (90% speed), so 2.7 s -> 3 s.
-# actual periods are 10/9ths what they're recorded as.
-PLAY_LENGTH: float = 2.7
+# NOTE: frames are now scheduled against the wall clock, so this and the
+# recorded periods are what is actually shown. the data/ collected so far
+# counted ticks instead and ran at 90% speed on the lab computer
+# (2.7 s -> 3 s; actual periods were 10/9ths what they're recorded as).
+PLAY_LENGTH: float = 3.0
 # times to show each level per block
 LEVEL_REPS: int = 10
 
+# choose each experimental trial's condition from the ratings so far (see
+# adaptive.py) instead of running every block of the full factorial. the
+# practice block is still one block of BLOCK_CONDITIONS, shuffled. only
+# chooses from the levels above
+ADAPTIVE: bool = False
+# experimental trials in an adaptive session (the full factorial has
+# N_TRIALS * (N_BLOCKS - 1)); there is still a rest every N_TRIALS
+ADAPTIVE_TRIALS: int = N_TRIALS
+# end an adaptive session early once the posterior standard deviation of
+# every condition's mean rating is below this. the model is fitted to the
+# ratings, so this comes sooner the smoother and less noisy they are. None
+# to always run ADAPTIVE_TRIALS
+ADAPTIVE_TARGET_SD: float = None
+
+# record the timing of every frame and save it to data/timing/
+LOG_TIMING: bool = False
+# frames held in the timing ring buffer; must be more than one trial's worth
+TIMING_BUFFER_SIZE: int = 4096
+
 SEIZURE_WARNING: str = "WARNING: participating may potentially trigger"\
     + " seizures for people with photosensitive epilepsy."\
     + " If you suspect you have photosensitive epilepsy or have a history"\
     + " of photosensitive epilepsy, please press the [No] button now."\
     + "\n\nDo you wish to proceed?"
 
-with open("script.txt", "r") as f:
+RESUME_TEXT: str = "Welcome back\n\nThe experiment will continue"\
+    + " where it left off."
+
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       "script.txt"), "r") as f:
     script = tuple(f.read().split("==="))
 (INTRO_TEXT,
  INTRO_TEXT2,
@@ -118,21 +190,57 @@ text: int
 # fixation: list[int]
 fixation = []
 
-# [canvas id, [inner_x, inner_y]]
-# inner coords used for updating position of lines during animation
-# lines: list[int, list[int]]
-lines = []
+# canvas ids and current vertices (x0, y0, x1, y1, ...) of each line.
+# reallocated only when n_stim or the shape changes; updated in place
+# during animation
+line_ids: np.array = np.zeros(0, dtype=int)
+line_coords: np.array = np.zeros((0, 4))
+# change in the vertices of each line since the last frame
+line_deltas: np.array = np.zeros((0, 4))
 
 # self-explanatory
 line_length: int
 # radius of circle of lines (through midpoints)
 stim_radius: int
-anim_radius: int
 
 # of one expansion and contraction, in frames (= 1 s)
 stim_period: int
+# angle from radius to line, in degrees
+line_angle: float
+# number of lines
+n_stim: int
 
 frame_count: int
+# perf_counter() time at which frame 0 of the current trial was drawn
+trial_start: float
+# perf_counter() time at which the next tick was scheduled to run
+tick_due: float
+
+# ring buffer of per-frame timing (storage.TIMING_DTYPE), allocated once if
+# LOG_TIMING is set
+timing_log: np.array
+# total frames logged so far (the next slot is timing_index % buffer size)
+timing_index: int = 0
+# timing_index at the start of the current trial
+timing_trial_start: int = 0
+
+# vertices of every line for one period, from geometry.trajectory()
+# shape (stim_period, n_stim, 2 * number of vertices)
+stim_frames: np.array
+# endpoints of the lines at each frame, split out of stim_frames once per
+# trial so that looking up a frame doesn't create a new array
+frame_coords = []  # list[np.array]
+# canvas ids of the lines and the flattened coords of each frame, passed to
+# the set_coords Tcl procedure when BATCH_UPDATES is set
+tcl_line_ids = []  # list[int]
+frame_args = []  # list[list[float]]
+# in SPRITE_MODE: the images of the conditions shown and about to be, the
+# canvas id of the image item, the images of the current condition, and the
+# image to show at each frame of the period
+sprite_cache: sprites.SpriteCache = None
+sprite_item: int
+sprite_images = []  # list[PhotoImage]
+sprite_index = []  # list[int]
 
 # in the current trial, whether the subject has rated the illusion or not
 entered: bool
@@ -142,13 +250,32 @@ rated: bool
 phase: int
 # current state of program: what is being animated.
 state: int
-# stores index of line length, angle to use for each trial
-trials = []  # list[list[int]]
+# (line_length, stim_radius, stim_period, line_angle, n_stim) of each trial
+trials = []  # list[tuple]
+# seed of the RNG the trials were shuffled with
+seed: int
+# whether this session chooses its trials adaptively, and the model doing so
+adaptive_session: bool = False
+design: adaptive.GridDesign = None
+# connection to the controller.py assigning the trial order and collecting
+# the results, or None if the session runs on its own
+client: station.StationClient = None
+# which of the controller's counterbalanced orders the trials follow
+order: int = None
+# absolute path of the experiment definition the constants were loaded
+# from, or None for the ones above
+config_file: str = None
 # current trial index
 trial: int
-# line length, stim radius, stim period, user rating
+# line length, stim radius, stim period, line angle, number of lines, user
+# rating
 practice_results = []  # for postmortem analysis
-results = []  # list[tuple[int, int, int, int]]
+results = []  # list[tuple]
+# append each result (and each trial's frame timing) to data/ as soon as
+# it is recorded. the writes themselves run on io_thread
+writer: storage.TrialWriter = None
+timing_writer: storage.TimingWriter = None
+io_thread: storage.WriterThread = None
 
 # gets printed to console when experiment is closed
 stop_message: str = "Experiment was closed early."
@@ -189,92 +316,171 @@ def mark_rated(_: Event) -> None:
         canvas.itemconfig(text, text="(Press the [Next] button to continue)")
 
 
-def pol_to_rect(r: float, theta: float) -> np.array:
+def get_coords() -> np.array:
     """
-    Converts polar coordinates to rectangular coordinates.
+    Returns the endpoints of all lines at the current frame.
 
     Parameters
     ----------
-    r: float radius.
-    theta: float angle in degrees.
+    None taken.
 
     Returns
     -------
-    np.array rectangular vector.
+    np.array (n_stim, 2 * number of vertices) array of vertices; for
+    straight lines, (inner x, inner y, outer x, outer y).
     """
-    return np.array((r * cos(theta * pi / 180), r * sin(theta * pi / 180)))
+    return stim_frames[frame_count % stim_period]
 
 
-def get_inner(i: int) -> np.array:
+def update_stimulus() -> None:
     """
-    Returns the inner endpoint of the i-th line.
+    Redraw the stimulus (lines) to their new positions.
 
     Parameters
     ----------
-    i: int index of the line.
+    None taken.
 
     Returns
     -------
-    np.array rectangular vector.
+    None
     """
-    # (center of screen) + (radius vector) - 1/2 (line vector)
-    return np.array((screen_width / 2, canvas.winfo_height() / 2))\
-        + pol_to_rect(anim_radius, i / N_STIM * 360)\
-        - pol_to_rect(line_length, LINE_ANGLE + i / N_STIM * 360) * 0.5
+    if SPRITE_MODE:
+        canvas.itemconfigure(
+            sprite_item,
+            image=sprite_images[sprite_index[frame_count % stim_period]])
+        return
+    if BATCH_UPDATES:
+        canvas.tk.call("set_coords", canvas._w, tcl_line_ids,
+                       stim_frames.shape[2],
+                       frame_args[frame_count % stim_period])
+        return
+    coords = frame_coords[frame_count % stim_period]
+    np.subtract(coords, line_coords, out=line_deltas)
+    np.copyto(line_coords, coords)
+    for i in range(n_stim):
+        canvas.move(line_ids[i], line_deltas[i, 0], line_deltas[i, 1])
 
 
-def get_outer(i: int) -> np.array:
+def session_name() -> str:
     """
-    Returns the outer endpoint of the i-th line.
+    Returns the name shared by all files saved for this session.
 
     Parameters
     ----------
-    i: int index of the line.
+    None taken.
 
     Returns
     -------
-    np.array rectangular vector.
+    str participant initials followed by the session start time.
     """
-    # (center of screen) + (radius vector) + 1/2 (line vector)
-    return np.array((screen_width / 2, canvas.winfo_height() / 2))\
-        + pol_to_rect(anim_radius, i / N_STIM * 360)\
-        + pol_to_rect(line_length, LINE_ANGLE + i / N_STIM * 360) * 0.5
+    filename = initials_var.get().lower() + cur_time.__str__()
+    return filename.replace(" ", "").replace(":", "-")
 
 
-def update_stimulus() -> None:
+def log_frame(tick_time: float) -> None:
     """
-    Redraw the stimulus (lines) to their new positions.
+    Record the timing of the frame that was just drawn.
+    Writes into the preallocated ring buffer, so nothing grows while a trial
+    is playing.
 
     Parameters
     ----------
-    None taken.
+    tick_time: float perf_counter() time at which the tick started.
 
     Returns
     -------
-    None
+    None.
+    """
+    global timing_index
+    timing_log[timing_index % TIMING_BUFFER_SIZE] = (
+        trial, frame_count, tick_time - trial_start,
+        perf_counter() - tick_time, tick_time - tick_due)
+    timing_index += 1
+
+
+def run_io(function, *args) -> None:
+    """
+    Run a file operation on the writer thread, so that it never holds up
+    the Tk loop. Runs it right away if there is no writer thread.
+
+    Parameters
+    ----------
+    function: callable function to call.
+    args: arguments to call it with.
+
+    Returns
+    -------
+    None.
     """
-    global lines, anim_radius
-    cur_frame = frame_count % stim_period
-    if cur_frame < stim_period / 2:
-        anim_radius = stim_radius + (MAX_DISPLACEMENT * 2
-                                     * cur_frame / stim_period)
+    if io_thread is None:
+        function(*args)
     else:
-        anim_radius = stim_radius + (MAX_DISPLACEMENT * 2
-                                     * (stim_period - cur_frame) / stim_period)
-    for i in range(N_STIM):
-        cur_inner = lines[i][1]
-        new_inner = list(get_inner(i))
-        canvas.move(
-            lines[i][0],
-            new_inner[0] - cur_inner[0],
-            new_inner[1] - cur_inner[1]
-        )
-        lines[i][1] = new_inner
+        io_thread.submit(function, *args)
+
+
+def summarize_timing() -> None:
+    """
+    Copy the current trial's frames out of the timing ring buffer,
+    summarize them and queue both to be saved to data/timing/.
+    Called once the trial has finished playing.
+
+    Parameters
+    ----------
+    None taken.
+
+    Returns
+    -------
+    None.
+    """
+    global timing_writer
+    start = max(timing_trial_start, timing_index - TIMING_BUFFER_SIZE)
+    frames = timing_log.take(range(start, timing_index), mode="wrap")
+    if len(frames) < 2:
+        return
+    n_frames = frames["frame"][-1] - frames["frame"][0]
+    duration = frames["time"][-1] - frames["time"][0]
+    summary = (
+        trial,
+        stim_period,
+        len(frames),
+        n_frames + 1 - len(frames),
+        duration / (len(frames) - 1),
+        duration / n_frames * stim_period,
+        frames["compute"].max(),
+        np.percentile(frames["jitter"], 99)
+    )
+    if timing_writer is None:
+        timing_writer = storage.TimingWriter("data/timing/" + session_name())
+    run_io(timing_writer.append, frames, summary)
+
+
+def record_result(result: tuple) -> None:
+    """
+    Record the result of an experimental trial, in memory and on disk.
+
+    Parameters
+    ----------
+    result: tuple line length, stim radius, stim period, line angle,
+    number of lines, user rating.
+
+    Returns
+    -------
+    None.
+    """
+    global writer
+    if writer is None:
+        writer = storage.TrialWriter("data/" + session_name())
+    record = (len(results), len(results) // N_TRIALS) + result
+    run_io(writer.append, record)
+    if client is not None:
+        run_io(client.result, session_name(), record)
+    results.append(result)
 
 
 def save() -> None:
     """
-    Save all data to file.
+    Finish saving all data to file. The results themselves have already
+    been queued by record_result().
 
     Parameters
     ----------
@@ -284,21 +490,38 @@ def save() -> None:
     -------
     None.
     """
-    filename = "data/" + initials_var.get().lower()\
-        + cur_time.__str__() + ".csv"
-    filename = filename.replace(" ", "").replace(":", "-")
-    with open(filename, "w") as f:
-        f.write("trial,line_length,stim_radius,stim_period,rating")
-        f.write("\n")
-        for trial_result in enumerate(results):
-            f.write(
-                ",".join(
-                    [str(trial_result[0]), str(trial_result[1][0]),
-                     str(trial_result[1][1]), str(trial_result[1][2]),
-                     str(trial_result[1][3])]
-                )
-            )
-            f.write("\n")
+    if writer is not None:
+        run_io(writer.close, True)
+    if timing_writer is not None:
+        run_io(timing_writer.close)
+    if client is not None:
+        run_io(client.end, session_name(), True)
+
+
+def close_io() -> None:
+    """
+    Close all open files, waiting for any queued writes to finish.
+    Results of an unfinished session are left in data/ as .csv.part.
+
+    Parameters
+    ----------
+    None taken.
+
+    Returns
+    -------
+    None.
+    """
+    global io_thread
+    if writer is not None:
+        run_io(writer.close)
+    if timing_writer is not None:
+        run_io(timing_writer.close)
+    if client is not None:
+        # does nothing if save() has already ended the session
+        run_io(client.end, session_name(), False)
+    if io_thread is not None:
+        io_thread.close()
+        io_thread = None
 
 
 def handle_button() -> None:
@@ -328,13 +551,12 @@ def handle_button() -> None:
     elif phase == PHASE_PRAC:
         if state == STATE_INTRO:
             state = STATE_PLAY
-            trial = 0
             start_trial()
         elif state == STATE_RATE:
             if not rated:
                 return
             practice_results.append((line_length, stim_radius, stim_period,
-                                     slider_var.get()))
+                                     line_angle, n_stim, slider_var.get()))
             if trial == N_TRIALS:
                 phase = PHASE_REST
                 state = STATE_INTRO
@@ -354,20 +576,97 @@ def handle_button() -> None:
         elif state == STATE_RATE:
             if not rated:
                 return
-            results.append((line_length, stim_radius, stim_period,
-                            slider_var.get()))
-            if trial == N_TRIALS * N_BLOCKS:
+            record_result((line_length, stim_radius, stim_period,
+                           line_angle, n_stim, slider_var.get()))
+            if adaptive_session:
+                design.update(level_cell(trials[trial - 1]), results[-1][-1])
+            if session_done():
                 phase = PHASE_END
                 state = STATE_INTRO
                 save()
                 canvas.itemconfig(text, state="normal", text=END_TEXT)
-            elif trial % N_TRIALS == 0:
-                phase = PHASE_REST
-                state = STATE_INTRO
-                canvas.itemconfig(text, state="normal", text=REST_TEXT)
             else:
-                state = STATE_PLAY
-                start_trial()
+                if adaptive_session:
+                    trials.append(condition(design.choose()))
+                if trial % N_TRIALS == 0:
+                    phase = PHASE_REST
+                    state = STATE_INTRO
+                    canvas.itemconfig(text, state="normal", text=REST_TEXT)
+                else:
+                    state = STATE_PLAY
+                    start_trial()
+    checkpoint()
+
+
+def session_done() -> bool:
+    """
+    Returns whether every experimental trial has been run.
+
+    Parameters
+    ----------
+    None taken.
+
+    Returns
+    -------
+    bool whether the session is over.
+    """
+    if not adaptive_session:
+        return trial == N_TRIALS * N_BLOCKS
+    return len(results) >= ADAPTIVE_TRIALS\
+        or (ADAPTIVE_TARGET_SD is not None
+            and design.sd().max() < ADAPTIVE_TARGET_SD)
+
+
+def condition(cell: tuple) -> tuple:
+    """
+    Returns the condition at a cell of the grid of levels.
+
+    Parameters
+    ----------
+    cell: tuple[int, int, int] indices into LINE_LENGTHS, STIM_RADII and
+    STIM_PERIODS.
+
+    Returns
+    -------
+    tuple (line_length, stim_radius, stim_period, line_angle, n_stim), with
+    LINE_ANGLE and N_STIM.
+    """
+    return (LINE_LENGTHS[cell[0]], STIM_RADII[cell[1]],
+            STIM_PERIODS[cell[2]], LINE_ANGLE, N_STIM)
+
+
+def level_cell(values: tuple) -> tuple:
+    """
+    Returns the cell of the grid of levels a condition is at.
+
+    Parameters
+    ----------
+    values: tuple condition, starting with line_length, stim_radius and
+    stim_period, each of which must be one of the levels.
+
+    Returns
+    -------
+    tuple[int, int, int] indices into LINE_LENGTHS, STIM_RADII and
+    STIM_PERIODS.
+    """
+    return (LINE_LENGTHS.index(values[0]), STIM_RADII.index(values[1]),
+            STIM_PERIODS.index(values[2]))
+
+
+def new_design() -> adaptive.GridDesign:
+    """
+    Returns a fresh model for choosing trials adaptively.
+
+    Parameters
+    ----------
+    None taken.
+
+    Returns
+    -------
+    adaptive.GridDesign the model, with no ratings.
+    """
+    return adaptive.GridDesign((N_LINE_LENGTHS, N_STIM_RADII, N_STIM_PERIODS),
+                               seed)
 
 
 def stop_trial() -> None:
@@ -382,16 +681,23 @@ def stop_trial() -> None:
     -------
     None.
     """
-    global trial
+    global trial, sprite_images
     canvas.delete("line")
+    # the images themselves stay in sprite_cache
+    sprite_images = []
     for i in fixation:
         canvas.itemconfig(i, state="hidden")
+    if LOG_TIMING:
+        summarize_timing()
     trial += 1
 
 
 def animate() -> None:
     """
     Animates the illusion.
+    The frame to show is computed from the time elapsed since the start of
+    the trial, so frames are skipped (or held) when a tick runs late instead
+    of the whole animation slowing down.
 
     Parameters
     ----------
@@ -401,10 +707,15 @@ def animate() -> None:
     -------
     None
     """
-    global state, frame_count
+    global state, frame_count, tick_due
 
     if state == STATE_PLAY:
-        if frame_count > PLAY_LENGTH * UPDATES_PER_SECOND:
+        tick_time = perf_counter()
+        # a tick right on a frame boundary can come out just below it in
+        # floating point; without the margin the frame would never advance
+        cur_frame = int((tick_time - trial_start) * UPDATES_PER_SECOND
+                        + 1e-6)
+        if cur_frame > PLAY_LENGTH * UPDATES_PER_SECOND:
             stop_trial()
             state = STATE_RATE
             if not rated:
@@ -413,11 +724,58 @@ def animate() -> None:
                 # text already configured to "Press next"
                 canvas.itemconfig(text, state="normal")
         else:
-            update_stimulus()
-            frame_count += 1
+            if cur_frame != frame_count:
+                frame_count = cur_frame
+                update_stimulus()
+                if LOG_TIMING:
+                    log_frame(tick_time)
+            # wake up at the start of the next frame, and never in the same
+            # instant, which would keep Tk from doing anything else
+            tick_due = trial_start + (frame_count + 1) / UPDATES_PER_SECOND
+            canvas.after(max(1, ceil((tick_due - perf_counter()) * 1000)),
+                         animate)
+            return
+    if SPRITE_MODE:
+        prefetch_sprites()
     canvas.after(1000 // UPDATES_PER_SECOND, animate)
 
 
+def sprite_key(values: tuple) -> tuple:
+    """
+    Returns the key of a condition in sprite_cache.
+
+    Parameters
+    ----------
+    values: tuple (line_length, stim_radius, stim_period, line_angle,
+    n_stim), as in trials.
+
+    Returns
+    -------
+    tuple arguments to sprites.render_period(), quantized as shown.
+    """
+    return geometry.quantize(values[4], values[3], *values[:3])\
+        + (MAX_DISPLACEMENT, LINE_WIDTH, STIM_SHAPE, SHAPE_PARAMS)
+
+
+def prefetch_sprites() -> None:
+    """
+    Start rendering the frames of the next SPRITE_PREFETCH trials, and make
+    images of the frames already rendered for up to half a frame. Called
+    every tick while nothing is playing.
+
+    Parameters
+    ----------
+    None taken.
+
+    Returns
+    -------
+    None.
+    """
+    for values in trials[trial:trial + SPRITE_PREFETCH]:
+        sprite_cache.prefetch(sprite_key(values))
+    sprite_cache.step(perf_counter() + 0.5 / UPDATES_PER_SECOND)
+
+
 def start_trial() -> None:
     """
     Sets up the beginning of each trial.
@@ -430,36 +788,213 @@ def start_trial() -> None:
     -------
     None.
     """
-    global line_length, stim_radius, stim_period, frame_count, rated,\
-        anim_radius
+    global line_length, stim_radius, stim_period, line_angle, n_stim,\
+        frame_count, rated, stim_frames, trial_start, tick_due,\
+        timing_trial_start, line_ids, line_coords, line_deltas, frame_coords,\
+        tcl_line_ids, frame_args, sprite_item, sprite_images, sprite_index
 
     canvas.itemconfig(text, state="hidden")
     for i in fixation:
         canvas.itemconfigure(i, state="normal")
 
-    line_length = LINE_LENGTHS[trials[trial][0]]
-    stim_radius = STIM_RADII[trials[trial][1]]
-    anim_radius = stim_radius
-    stim_period = STIM_PERIODS[trials[trial][2]]
+    # what is shown (and recorded) is the condition rounded to the
+    # resolution of the geometry cache; periods are whole frames
+    (n_stim, line_angle, line_length, stim_radius, stim_period) =\
+        geometry.quantize(trials[trial][4], trials[trial][3],
+                          *trials[trial][:3])
+
+    # all trig and arithmetic happens here, not while the animation plays
+    stim_frames = geometry.trajectory(
+        (screen_width / 2, canvas.winfo_height() / 2), n_stim, line_angle,
+        line_length, stim_radius, stim_period, MAX_DISPLACEMENT, STIM_SHAPE,
+        SHAPE_PARAMS)
+    frame_count = 0
 
-    lines.clear()
+    if SPRITE_MODE:
+        # usually prefetched during the last rating or rest
+        (sprite_images, sprite_index) = sprite_cache.get(
+            sprite_key(trials[trial]))
+        sprite_item = canvas.create_image(
+            screen_width / 2, canvas.winfo_height() / 2,
+            image=sprite_images[sprite_index[0]], tags=["line", "play"])
+        canvas.tag_raise("fixation")
 
-    for i in range(N_STIM):
-        line_id = canvas.create_line(
-            *get_inner(i),
-            *get_outer(i),
-            fill="black",
-            width=LINE_WIDTH,
-            tags=["line", "play"]
-        )
-        lines.append([line_id, list(get_inner(i))])
+    else:
+        if line_coords.shape != stim_frames.shape[1:]:
+            line_ids = np.zeros(n_stim, dtype=int)
+            line_coords = np.zeros(stim_frames.shape[1:])
+            line_deltas = np.zeros(stim_frames.shape[1:])
+        np.copyto(line_coords, get_coords())
+        for i in range(n_stim):
+            line_ids[i] = canvas.create_line(
+                *line_coords[i],
+                fill="black",
+                width=LINE_WIDTH,
+                tags=["line", "play"]
+            )
+        if BATCH_UPDATES:
+            tcl_line_ids = line_ids.tolist()
+            frame_args = stim_frames.reshape(stim_period, -1).tolist()
+        else:
+            frame_coords = list(stim_frames)
 
     slider.set(0)
-    frame_count = 0
+    trial_start = perf_counter()
+    tick_due = trial_start + 1 / UPDATES_PER_SECOND
+    timing_trial_start = timing_index
     entered = False
     rated = False
 
 
+def checkpoint() -> None:
+    """
+    Queue a snapshot of the session's progress to be saved next to its
+    results, so that it can be resumed with --resume after a crash.
+
+    Parameters
+    ----------
+    None taken.
+
+    Returns
+    -------
+    None.
+    """
+    run_io(storage.save_checkpoint, "data/" + session_name() + ".session.json",
+           {
+               "initials": initials_var.get(),
+               "time": str(cur_time),
+               "seed": seed,
+               "adaptive": adaptive_session,
+               "config": config_file,
+               "order": order,
+               "phase": phase,
+               "trial": trial,
+               "trials": [list(t) for t in trials]
+           })
+
+
+def new_session() -> None:
+    """
+    Set up a new session: shuffle the trials of every block with a freshly
+    seeded RNG, or take their order from the controller if there is one.
+    If ADAPTIVE, only the practice block is used, and the experimental
+    trials are chosen one by one as the ratings come in.
+
+    Parameters
+    ----------
+    None taken.
+
+    Returns
+    -------
+    None.
+    """
+    global phase, state, trial, trials, seed, results, adaptive_session,\
+        design, order
+    phase = PHASE_START
+    state = STATE_INTRO
+    trial = 0
+    results = []
+    seed = SystemRandom().getrandbits(32)
+    rng = Random(seed)
+
+    if BLOCK_CONDITIONS:
+        block = [tuple(c) for c in BLOCK_CONDITIONS]
+    else:
+        block = []
+        for i in range(N_LINE_LENGTHS):
+            for j in range(N_STIM_RADII):
+                for k in range(N_STIM_PERIODS):
+                    block.append(condition((i, j, k)))
+    trials = []
+    if client is not None:
+        assigned = client.hello(session_name())
+        order = assigned["order"]
+        trials = [tuple(t) for t in assigned["trials"]]
+        if sorted(trials) != sorted(block * N_BLOCKS):
+            raise ValueError("the controller is running a different"
+                             + " experiment; give it the same --config")
+        if ADAPTIVE:
+            trials = trials[:N_TRIALS]
+    else:
+        for _ in range(1 if ADAPTIVE else N_BLOCKS):
+            rng.shuffle(block)
+            trials += block[:]
+
+    adaptive_session = ADAPTIVE
+    if adaptive_session:
+        design = new_design()
+        trials.append(condition(design.choose()))
+
+
+def resume_session(name: str) -> str:
+    """
+    Restore a session from its checkpoint and the results it has saved.
+    It restarts at the first trial that was not rated.
+
+    Parameters
+    ----------
+    name: str name of the session (its files in data/, without extension).
+
+    Returns
+    -------
+    str text to show when the experiment starts, or None if the session is
+    already complete.
+    """
+    global phase, state, trial, trials, seed, results, cur_time,\
+        initials_var, adaptive_session, design, order
+    saved = storage.load_checkpoint("data/" + name + ".session.json")
+    initials_var = StringVar(window, value=saved["initials"])
+    cur_time = datetime.fromisoformat(saved["time"])
+    seed = saved["seed"]
+    order = saved.get("order")
+    adaptive_session = saved.get("adaptive", False)
+    if adaptive_session:
+        design = new_design()
+    # sessions checkpointed by older versions saved indices into the levels
+    trials = [tuple(t) if len(t) > 3 else condition(t)
+              for t in saved["trials"]]
+    phase = saved["phase"]
+    state = STATE_INTRO
+    trial = saved["trial"]
+    if phase == PHASE_END:
+        return None
+
+    # the saved results are the most up to date record of progress
+    results = []
+    if os.path.exists("data/" + name + ".trials"):
+        results = [tuple(r.tolist())[2:] for r in
+                   storage.load_trials("data/" + name + ".trials")]
+    if client is not None:
+        # send whatever the controller missed before the session stopped
+        received = client.hello(name, resume=True)["received"]
+        for (i, r) in enumerate(results[received:], received):
+            client.result(name, (i, i // N_TRIALS) + r)
+    if phase == PHASE_START:
+        return INTRO_TEXT + NEXT_PROMPT
+
+    if phase != PHASE_PRAC:
+        trial = N_TRIALS + len(results)
+        if adaptive_session:
+            # replaying the ratings rebuilds the model exactly, and with it
+            # the choice of the next trial
+            for r in results:
+                design.update(level_cell(r), r[-1])
+        if session_done():
+            # every result was saved, but not the end of the session
+            if os.path.exists("data/" + name + ".csv.part"):
+                os.replace("data/" + name + ".csv.part",
+                           "data/" + name + ".csv")
+            if client is not None:
+                client.end(name, True)
+            return None
+        if adaptive_session:
+            trials = trials[:trial] + [condition(design.choose())]
+        phase = PHASE_REST if trial % N_TRIALS == 0 else PHASE_EXP
+    if phase == PHASE_REST:
+        return REST_TEXT
+    return RESUME_TEXT + NEXT_PROMPT
+
+
 def stop(_: Event = None):
     """
     Stop the experiment.
@@ -473,6 +1008,7 @@ def stop(_: Event = None):
     None.
     """
     print(stop_message)
+    close_io()
     window.destroy()
 
 
@@ -527,21 +1063,39 @@ def info_dialog() -> None:
     dlg.wait_window()  # block until window is destroyed
 
 
-def main() -> None:
+def main(resume: str = None, experiment: str = None,
+         controller: str = None) -> None:
     """
     Entry point. Initializes the experiment.
 
     Parameters
     ----------
-    none taken.
+    resume: str name of a session to resume instead of starting a new one.
+    experiment: str path of an experiment definition (see config.py) to
+    run instead of the constants above. A resumed session uses the one it
+    was started with by default.
+    controller: str HOST:PORT of a controller.py to take the trial order
+    from and stream the results to, or None to run on its own.
 
     Returns
     -------
     None
     """
-    global window, canvas, frame, phase, state, cur_time, fixation,\
-        screen_width, screen_height, lines, results, exit_btn, slider_var,\
-        slider, next_btn, text, trials
+    global window, canvas, frame, cur_time, fixation, screen_width,\
+        screen_height, exit_btn, slider_var, slider, next_btn, text,\
+        timing_log, io_thread, config_file, client, sprite_cache
+    if experiment is None and resume is not None:
+        experiment = storage.load_checkpoint(
+            "data/" + resume + ".session.json").get("config")
+    plan = None
+    if experiment is not None:
+        # fails here, before anything is shown, if the definition is invalid
+        config_file = os.path.abspath(experiment)
+        plan = config.load_plan(config.load_config(config_file), globals())
+        globals().update(plan["constants"])
+    if controller is not None:
+        client = station.StationClient(controller)
+
     window = Tk()
     window.attributes('-fullscreen', True)
     screen_width = window.winfo_screenwidth()
@@ -576,6 +1130,11 @@ def main() -> None:
 
     canvas = Canvas(window, bg="white", highlightthickness=0)
     canvas.grid(row=1, column=0, sticky="nsew")
+    canvas.tk.eval(SET_COORDS_PROC)
+    if SPRITE_MODE:
+        sprite_cache = sprites.SpriteCache(
+            lambda frame: PhotoImage(data=sprites.to_pgm(frame), format="PPM"),
+            SPRITE_CACHE_BYTES)
 
     window.rowconfigure(0, weight=MENU_WEIGHT)
     window.rowconfigure(1, weight=CANVAS_WEIGHT)
@@ -587,15 +1146,26 @@ def main() -> None:
         print(stop_message)
         return
 
-    # collect initials and time
-    info_dialog()
-    cur_time = datetime.now()
+    if resume is None:
+        # collect initials and time
+        info_dialog()
+        cur_time = datetime.now()
+        new_session()
+        start_text = INTRO_TEXT + NEXT_PROMPT
+    else:
+        start_text = resume_session(resume)
+        if start_text is None:
+            print("Session " + resume + " is already complete.")
+            window.destroy()
+            return
+    io_thread = storage.WriterThread()
+    io_thread.start()
+    window.protocol("WM_DELETE_WINDOW", stop)
 
     try:
         # setup
-        phase = PHASE_START
-        state = STATE_INTRO
-        results = []
+        if LOG_TIMING:
+            timing_log = np.zeros(TIMING_BUFFER_SIZE, storage.TIMING_DTYPE)
         fixation = [
             canvas.create_rectangle(screen_width / 2 - 10,
                                     canvas.winfo_height() / 2 - 3,
@@ -613,23 +1183,36 @@ def main() -> None:
                                     state="hidden")
         ]
 
-        block = []
-        for i in range(N_LINE_LENGTHS):
-            for j in range(N_STIM_RADII):
-                for k in range(N_STIM_PERIODS):
-                    block.append((i, j, k))
-        for _ in range(N_BLOCKS):
-            shuffle(block)
-            trials += block[:]
-
         text = canvas.create_text(screen_width / 2, screen_height / 2,
-                                  text=INTRO_TEXT + NEXT_PROMPT,
+                                  text=start_text,
                                   tags=["start"], **TEXT_ARGS)
+        if plan is not None:
+            config.load_geometry(plan, (screen_width / 2,
+                                        canvas.winfo_height() / 2))
+        checkpoint()
         animate()
         window.mainloop()
-    except:
+    except KeyboardInterrupt:
+        print(stop_message)
+        close_io()
+    except Exception:
+        # anything else is a bug or a bad definition: say what it was
+        traceback.print_exc()
         print(stop_message)
+        close_io()
 
 
 if __name__ == "__main__":
-    main()
+    parser = ArgumentParser(description="Run the RLTI experiment.")
+    parser.add_argument("--resume", metavar="SESSION",
+                        help="resume a session that was interrupted, e.g."
+                        + " cd2022-10-1313-31-45.457695")
+    parser.add_argument("--config", metavar="PATH",
+                        help="run the experiment defined in a JSON file"
+                        + " (see config.py)")
+    parser.add_argument("--controller", metavar="HOST:PORT",
+                        help="take the trial order from a controller.py and"
+                        + " stream the results to it")
+    args = parser.parse_args()
+    main(os.path.basename(args.resume).split(".session")[0].split(".csv")[0]
+         if args.resume else None, args.config, args.controller)
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""Runs whole sessions of runner.py with simulated participants.
+
+Each participant presses [Next] and drags the slider through handle_button(),
+mark_entered() and mark_rated(), as the widgets would, after a random
+reaction time. Its ratings come from a model of the data: the linear mixed
+model of analysis/models.py, fit to the sessions in data/ (a straight line
+in each variable, plus a random offset per participant and noise per
+trial). The stimulus is animated by the real
+animate() loop on a virtual clock, so a session runs as fast as the code
+allows, and everything a session saves goes through the usual writer
+thread (and to a controller.py with --controller).
+
+Sessions run in parallel processes, each in its own data/ under --out.
+Reports throughput, memory growth over each session, and whether what was
+saved matches what was rated.
+
+Usage: python simulate.py [--sessions 8] [--jobs N] [--out DIR] [--config
+       PATH] [--controller HOST:PORT] [--memory] [--seed 0]
+"""
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+import csv
+from datetime import datetime
+import importlib
+import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+from time import perf_counter
+import numpy as np
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+import config
+import geometry
+import headless
+import runner
+import station
+import storage
+# the analysis scripts import each other by module name
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "analysis"))
+from dataset import load_dataset
+from models import coefficient, load_models
+
+# model of analysis/models.py the ratings come from, and the variables it
+# has a slope for
+MODEL: str = "linear_mixed"
+VARIABLES: tuple = ("line_length", "stim_radius", "stim_period")
+# median and log-standard deviation of each reaction time, in seconds:
+# reading a screen of text, dragging the slider and pressing [Next]
+READ_TIME: tuple = (4.0, 0.5)
+RATE_TIME: tuple = (1.5, 0.4)
+PRESS_TIME: tuple = (0.5, 0.3)
+# how often the participant checks whether the stimulus has finished, in s
+POLL_INTERVAL: float = 0.05
+
+
+class Participant:
+    """
+    Simulated participant, which acts on runner.py's widgets.
+    """
+
+    def __init__(self, clock: headless.VirtualClock,
+                 rng: np.random.Generator, model: dict) -> None:
+        """
+        Parameters
+        ----------
+        clock: headless.VirtualClock clock to act on.
+        rng: np.random.Generator source of ratings and reaction times.
+        model: dict model of the ratings, from load_model().
+        """
+        self.clock = clock
+        self.rng = rng
+        self.model = model
+        self.offset = rng.normal(0, model["participant_sd"])
+        # (line_length, stim_radius, stim_period, line_angle, n_stim,
+        # rating) of each experimental trial rated
+        self.given = []
+
+    def wait(self, times: tuple) -> None:
+        """
+        Act again after a random reaction time.
+
+        Parameters
+        ----------
+        times: tuple[float, float] median and log-standard deviation of
+        the reaction time, in seconds.
+
+        Returns
+        -------
+        None.
+        """
+        (median, sd) = times
+        self.clock.after(1000 * median * self.rng.lognormal(0, sd), self.act)
+
+    def rating(self) -> int:
+        """
+        Returns the rating of the stimulus just shown.
+
+        Parameters
+        ----------
+        None taken.
+
+        Returns
+        -------
+        int slider value, 0-100.
+        """
+        mean = self.model["intercept"] + self.offset\
+            + sum(slope * getattr(runner, variable)
+                  for (variable, slope) in self.model["slopes"].items())
+        return int(np.clip(round(
+            mean + self.rng.normal(0, self.model["noise_sd"])), 0, 100))
+
+    def act(self) -> None:
+        """
+        Do whatever the screen is waiting for, then wait to act again.
+
+        Parameters
+        ----------
+        None taken.
+
+        Returns
+        -------
+        None.
+        """
+        if runner.phase == runner.PHASE_END:
+            return
+        if runner.state == runner.STATE_PLAY:
+            self.clock.after(1000 * POLL_INTERVAL, self.act)
+        elif runner.state == runner.STATE_RATE and not runner.rated:
+            value = self.rating()
+            runner.mark_entered(None)
+            runner.slider_var.set(value)
+            runner.mark_rated(None)
+            if runner.phase == runner.PHASE_EXP:
+                self.given.append((runner.line_length, runner.stim_radius,
+                                   runner.stim_period, runner.line_angle,
+                                   runner.n_stim, value))
+            self.wait(PRESS_TIME)
+        else:
+            rating = runner.state == runner.STATE_RATE
+            runner.handle_button()
+            self.wait(RATE_TIME if runner.state == runner.STATE_PLAY
+                      or rating else READ_TIME)
+
+
+def load_model() -> dict:
+    """
+    Returns the model of the ratings: MODEL fit to the sessions in data/
+    (or the cached fit, if they have not changed).
+
+    Parameters
+    ----------
+    None taken.
+
+    Returns
+    -------
+    dict intercept; slopes, the slope against each of VARIABLES;
+    participant_sd, the standard deviation of each participant's offset;
+    and noise_sd, that of each rating around it.
+    """
+    (coefs, _) = load_models(load_dataset())
+    scale = coefficient(coefs, MODEL, "Scale")
+    return {
+        "intercept": coefficient(coefs, MODEL, "Intercept"),
+        "slopes": {v: coefficient(coefs, MODEL, v) for v in VARIABLES},
+        # Group Var is relative to the residual variance
+        "participant_sd": np.sqrt(coefficient(coefs, MODEL, "Group Var")
+                                  * scale),
+        "noise_sd": np.sqrt(scale)
+    }
+
+
+def memory() -> float:
+    """
+    Returns the memory the session is using: the Python heap if it is being
+    traced, else the peak resident size of the process.
+
+    Parameters
+    ----------
+    None taken.
+
+    Returns
+    -------
+    float MiB, or nan if it cannot be measured here.
+    """
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[0] / (1 << 20)
+    if resource is None:
+        return np.nan
+    # KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def check(name: str, given: list) -> list:
+    """
+    Check what a session saved against what was rated.
+
+    Parameters
+    ----------
+    name: str path of the session's files, without extension.
+    given: list[tuple] Participant.given.
+
+    Returns
+    -------
+    list[str] everything that is wrong; empty if nothing is.
+    """
+    errors = []
+    if os.path.exists(name + ".csv.part") or not os.path.exists(name + ".csv"):
+        errors.append("results were not marked complete")
+        return errors
+    if storage.load_checkpoint(name + ".session.json")["phase"]\
+            != runner.PHASE_END:
+        errors.append("checkpoint is not at the end of the session")
+    records = storage.load_trials(name + ".trials")
+    if not runner.adaptive_session\
+            and len(given) != runner.N_TRIALS * (runner.N_BLOCKS - 1):
+        errors.append(str(len(given)) + " trials rated")
+    if len(records) != len(given):
+        errors.append(str(len(records)) + " records for "
+                      + str(len(given)) + " ratings")
+    if list(records["trial"]) != list(range(len(records))):
+        errors.append("trial numbers are not in order")
+    if list(records["block"]) != [t // runner.N_TRIALS
+                                  for t in records["trial"]]:
+        errors.append("block numbers do not match the trial numbers")
+    for (record, values) in zip(records, given):
+        if tuple(record.tolist())[2:] != values:
+            errors.append("trial " + str(record["trial"]) + ": saved "
+                          + str(tuple(record.tolist())[2:]) + ", rated "
+                          + str(values))
+            break
+    with open(name + ".csv", "r") as f:
+        rows = list(csv.reader(f))
+    if rows[0] != list(storage.FIELDS)\
+            or rows[1:] != [[storage.format_value(x) for x in r.tolist()]
+                            for r in records]:
+        errors.append("CSV does not match the .trials records")
+    return errors
+
+
+def run_session(index: int, seed: np.random.SeedSequence, out: str,
+                model: dict, experiment: str = None, controller: str = None,
+                trace: bool = False) -> dict:
+    """
+    Run one whole session, as main() in runner.py would, with a simulated
+    participant.
+
+    Parameters
+    ----------
+    index: int number of the session, which names its initials.
+    seed: np.random.SeedSequence seed of the participant.
+    out: str directory to run in; results are saved to its data/.
+    model: dict model of the ratings, from load_model().
+    experiment: str path of an experiment definition, or None.
+    controller: str HOST:PORT of a controller.py, or None.
+    trace: bool whether to trace the Python heap (slower).
+
+    Returns
+    -------
+    dict the session's name, its statistics and errors.
+    """
+    os.makedirs(os.path.join(out, "data"), exist_ok=True)
+    os.chdir(out)
+    # a fresh module and trajectory cache, as a new runner.py would have
+    importlib.reload(runner)
+    geometry.clear_cache()
+    if experiment is not None:
+        plan = config.load_plan(config.load_config(experiment), vars(runner))
+        vars(runner).update(plan["constants"])
+    if trace:
+        tracemalloc.start()
+    wall_start = perf_counter()
+
+    clock = headless.VirtualClock()
+    # initials can only be letters
+    initials = "sim" + "".join(chr(ord("a") + int(d, 26))
+                               for d in np.base_repr(index, 26))
+    headless.install(runner, headless.StubCanvas(clock=clock), initials)
+    runner.perf_counter = clock.perf_counter
+    runner.StringVar = lambda _, value: headless.StubVar(value)
+    if controller is not None:
+        runner.client = station.StationClient(controller, initials)
+    runner.cur_time = datetime.now()
+    runner.new_session()
+    runner.io_thread = storage.WriterThread()
+    runner.io_thread.start()
+
+    participant = Participant(clock, np.random.default_rng(seed), model)
+    # memory at each rest (the first is after the practice block), and at
+    # the end
+    samples = []
+    phase = runner.phase
+
+    def done() -> bool:
+        nonlocal phase
+        if runner.phase != phase:
+            phase = runner.phase
+            if phase == runner.PHASE_REST:
+                samples.append(memory())
+        return phase == runner.PHASE_END
+
+    clock.after(0, runner.animate)
+    clock.after(0, participant.act)
+    clock.run(done)
+    samples.append(memory())
+    runner.close_io()
+    wall = perf_counter() - wall_start
+    if trace:
+        tracemalloc.stop()
+
+    name = os.path.join("data", runner.session_name())
+    return {
+        "name": name,
+        "trials": len(runner.trials),
+        "results": len(participant.given),
+        "ticks": clock.n_events,
+        "session_time": clock.now,
+        "wall_time": wall,
+        "memory": samples,
+        "errors": check(name, participant.given)
+    }
+
+
+def main() -> None:
+    """
+    Entry point. Parses arguments, runs the sessions and prints a report.
+
+    Parameters
+    ----------
+    None taken.
+
+    Returns
+    -------
+    None.
+    """
+    parser = ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sessions", type=int, default=8,
+                        help="number of sessions to run")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(),
+                        help="number of processes")
+    parser.add_argument("--out",
+                        help="directory to save the results in (kept);"
+                        + " defaults to a temporary one")
+    parser.add_argument("--config", metavar="PATH",
+                        help="experiment definition to run (see config.py)")
+    parser.add_argument("--controller", metavar="HOST:PORT",
+                        help="stream the results to a controller.py")
+    parser.add_argument("--memory", action="store_true",
+                        help="trace the Python heap instead of measuring"
+                        + " the peak resident size (slower)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the simulated participants")
+    args = parser.parse_args()
+
+    model = load_model()
+    print("ratings from " + MODEL + ": {intercept:.1f} ".format(**model)
+          + " ".join("{:+.3g} {}".format(s, v)
+                     for (v, s) in model["slopes"].items())
+          + ", participant SD {participant_sd:.1f}, noise SD {noise_sd:.1f}"
+          .format(**model), flush=True)
+    out = os.path.abspath(args.out or tempfile.mkdtemp(prefix="rlti-sim-"))
+    experiment = os.path.abspath(args.config) if args.config else None
+    seeds = np.random.SeedSequence(args.seed).spawn(args.sessions)
+    start = perf_counter()
+    with ProcessPoolExecutor(args.jobs) as pool:
+        jobs = [pool.submit(run_session, i, seeds[i], out, model,
+                            experiment, args.controller, args.memory)
+                for i in range(args.sessions)]
+        sessions = []
+        for job in jobs:
+            s = job.result()
+            sessions.append(s)
+            growth = s["memory"][-1] - s["memory"][0]
+            print("{name}: {results} results, {wall_time:.1f} s for"
+                  " {session_time:.0f} s of session, memory".format(**s)
+                  + " {:.1f} -> {:.1f} MiB ({:+.1f}), ".format(
+                      s["memory"][0], s["memory"][-1], growth)
+                  + ("; ".join(s["errors"]) or "ok"), flush=True)
+    wall = perf_counter() - start
+
+    results = sum(s["results"] for s in sessions)
+    print("{} sessions in {:.1f} s: {:.2f} sessions/s, {:.0f} trials/s,"
+          " {:.0f} ticks/s".format(
+              len(sessions), wall, len(sessions) / wall, results / wall,
+              sum(s["ticks"] for s in sessions) / wall))
+    print("each session: {:.1f} s (median), {:.0f}x real time".format(
+        np.median([s["wall_time"] for s in sessions]),
+        np.median([s["session_time"] / s["wall_time"] for s in sessions])))
+    failed = [s["name"] for s in sessions if s["errors"]]
+    print(str(len(failed)) + " sessions saved incorrectly"
+          + (": " + ", ".join(failed) if failed else ""))
+    if args.out is None:
+        shutil.rmtree(out)
+    else:
+        print("results saved in " + os.path.join(out, "data"))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
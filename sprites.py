@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""Pre-rendered frames of the stimulus, for playing it back as images."""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+import numpy as np
+
+import geometry
+
+# spacing of the points stamped along each line, in px
+SAMPLE_SPACING: float = 1.0
+# memory Tk uses for each pixel of an image (RGBA), whatever its format
+IMAGE_BYTES_PER_PIXEL: int = 4
+
+
+def rasterize(coords: np.array, shape: tuple, line_width: float,
+              out: np.array = None) -> np.array:
+    """
+    Draw one frame of the stimulus into a grayscale image.
+
+    Parameters
+    ----------
+    coords: np.array (n_stim, 2 * n_vertices) array of the vertices of each
+    line, in image coordinates. Consecutive vertices are joined by segments.
+    shape: tuple[int, int] height and width of the image, in px.
+    line_width: float width of the lines, in px.
+    out: np.array image to draw into instead of a new one. Not cleared.
+
+    Returns
+    -------
+    np.array uint8 image, black lines on white.
+    """
+    vertices = coords.reshape(len(coords), -1, 2)
+    p0 = vertices[:, :-1].reshape(-1, 2)
+    p1 = vertices[:, 1:].reshape(-1, 2)
+    # every segment gets the same number of samples, enough for the longest
+    n_samples = int(np.ceil(np.linalg.norm(p1 - p0, axis=1).max()
+                            / SAMPLE_SPACING)) + 1
+    t = np.linspace(0, 1, n_samples)[:, np.newaxis]
+    points = np.rint(p0[:, np.newaxis] + t * (p1 - p0)[:, np.newaxis])\
+        .astype(np.intp).reshape(-1, 1, 2)
+
+    # stamp a disk the width of the line at every sample
+    r = line_width / 2
+    offsets = np.mgrid[-int(r):int(r) + 1, -int(r):int(r) + 1]\
+        .reshape(2, -1).T
+    offsets = offsets[(offsets ** 2).sum(axis=1) <= r * r]
+    pixels = (points + offsets).reshape(-1, 2)
+    pixels = pixels[(pixels >= 0).all(axis=1) & (pixels[:, 0] < shape[1])
+                    & (pixels[:, 1] < shape[0])]
+
+    image = np.full(shape, 255, dtype=np.uint8) if out is None else out
+    image[pixels[:, 1], pixels[:, 0]] = 0
+    return image
+
+
+def render_period(n_stim: int, line_angle: float, line_length: float,
+                  stim_radius: float, stim_period: int,
+                  max_displacement: float, line_width: float,
+                  shape: str = "line", shape_params: tuple = ()) -> tuple:
+    """
+    Render one period of frames of a condition. The frames are cropped to
+    the stimulus and centered on it. Safe to call off the Tk thread.
+
+    Parameters
+    ----------
+    n_stim: int number of lines.
+    line_angle: float angle from radius to line, in degrees.
+    line_length: float length of each line.
+    stim_radius: float radius of the stimulus at rest.
+    stim_period: int frames per expansion and contraction.
+    max_displacement: float maximum amount of dilation/contraction.
+    line_width: float width of the lines.
+    shape: str name of the shape of each line, a key of geometry.SHAPES.
+    shape_params: tuple extra arguments to the shape function.
+
+    Returns
+    -------
+    tuple[np.array, list[int]] (n_unique, size, size) array of frames and,
+    for each frame of the period, the index of its image. The animation is
+    a triangle wave, so frames f and stim_period - f are the same image and
+    only about half the period is rendered.
+    """
+    table = geometry.trajectory((0, 0), n_stim, line_angle, line_length,
+                                stim_radius, stim_period, max_displacement,
+                                shape, shape_params)
+    # crop to the furthest any vertex gets from the center
+    half = int(np.ceil(np.abs(table).max() + line_width))
+    index = [min(f, stim_period - f) for f in range(stim_period)]
+    frames = np.stack([rasterize(table[f] + half, (2 * half, 2 * half),
+                                 line_width)
+                       for f in range(stim_period // 2 + 1)])
+    return frames, index
+
+
+class SpriteCache:
+    """
+    Playable images of conditions, made ahead of time. Frames are rendered
+    with render_period() on a worker thread as soon as a condition is
+    prefetch()ed, and made into images (which has to happen on the Tk
+    thread) a few at a time by step(), in the gaps between trials. Images
+    are kept least recently used first, within a budget counted at their
+    size as Tk holds them: IMAGE_BYTES_PER_PIXEL bytes a pixel.
+    """
+
+    def __init__(self, make_image, budget: int) -> None:
+        """
+        Parameters
+        ----------
+        make_image: callable making an image (e.g. a PhotoImage) from one
+        uint8 frame.
+        budget: int maximum total size of the cached images, in bytes.
+        """
+        self.make_image = make_image
+        self.budget = budget
+        self.pool = ThreadPoolExecutor(1, thread_name_prefix="sprites")
+        # key -> future of render_period()
+        self.rendering = OrderedDict()
+        # key -> (frames, index, images made so far)
+        self.converting = OrderedDict()
+        # key -> (images, index, bytes), least recently used first
+        self.images = OrderedDict()
+        self.nbytes = 0
+
+    def prefetch(self, key: tuple) -> None:
+        """
+        Start rendering a condition, unless it is already cached or on its
+        way.
+
+        Parameters
+        ----------
+        key: tuple arguments to render_period(), quantized.
+
+        Returns
+        -------
+        None.
+        """
+        if key not in self.images and key not in self.rendering\
+                and key not in self.converting:
+            self.rendering[key] = self.pool.submit(render_period, *key)
+
+    def convert(self, key: tuple, deadline: float = None) -> tuple:
+        """
+        Make images of a condition's rendered frames, caching them once
+        they are all made (if they fit in the budget).
+
+        Parameters
+        ----------
+        key: tuple key of a condition in self.converting.
+        deadline: float perf_counter() time to stop at, or None to finish.
+
+        Returns
+        -------
+        tuple[list, list[int]] as get(), or None if the deadline came first.
+        """
+        (frames, index, images) = self.converting[key]
+        while len(images) < len(frames):
+            if deadline is not None and perf_counter() > deadline:
+                return None
+            images.append(self.make_image(frames[len(images)]))
+        del self.converting[key]
+        nbytes = frames.size * IMAGE_BYTES_PER_PIXEL
+        while self.images and self.nbytes + nbytes > self.budget:
+            self.nbytes -= self.images.popitem(last=False)[1][2]
+        if nbytes <= self.budget:
+            self.images[key] = (images, index, nbytes)
+            self.nbytes += nbytes
+        return images, index
+
+    def step(self, deadline: float) -> None:
+        """
+        Make images of whatever has been rendered, until a deadline. Call
+        on the Tk thread while nothing is playing.
+
+        Parameters
+        ----------
+        deadline: float perf_counter() time to stop at.
+
+        Returns
+        -------
+        None.
+        """
+        for key in [k for (k, f) in self.rendering.items() if f.done()]:
+            self.converting[key] = self.rendering.pop(key).result() + ([],)
+        for key in list(self.converting):
+            if self.convert(key, deadline) is None:
+                return
+
+    def get(self, key: tuple) -> tuple:
+        """
+        Returns the images of a condition, waiting for them to be rendered
+        and made if they are not cached yet.
+
+        Parameters
+        ----------
+        key: tuple arguments to render_period(), quantized.
+
+        Returns
+        -------
+        tuple[list, list[int]] images and, for each frame of the period, the
+        index of its image (see render_period()).
+        """
+        if key in self.images:
+            self.images.move_to_end(key)
+            return self.images[key][:2]
+        if key not in self.converting:
+            self.prefetch(key)
+            self.converting[key] = self.rendering.pop(key).result() + ([],)
+        return self.convert(key)
+
+
+def to_pgm(image: np.array) -> bytes:
+    """
+    Encode a grayscale image as binary PGM, which tkinter's PhotoImage can
+    load without any extra libraries.
+
+    Parameters
+    ----------
+    image: np.array 2d uint8 image.
+
+    Returns
+    -------
+    bytes PGM file contents.
+    """
+    return b"P5 %d %d 255\n" % (image.shape[1], image.shape[0])\
+        + image.tobytes()
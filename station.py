@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""The station end of the connection to controller.py.
+
+Messages are JSON objects, one per line, over TCP:
+    station -> controller
+        {"type": "hello", "station": ..., "session": ..., "resume": bool}
+            answered with {"type": "order", "order": int, "trials": [...]}
+            for a new session, or {"type": "resume", "received": int} (the
+            number of its results the controller already has).
+        {"type": "result", "session": ..., "record": [...]}
+            one trial's values of storage.FIELDS. Not answered.
+        {"type": "end", "session": ..., "complete": bool}
+            not answered.
+Only the hello waits for an answer; results are sent from the writer thread
+as they are recorded, so the controller never holds up the Tk loop.
+"""
+
+import json
+import socket
+
+# seconds to wait for the controller to connect and answer a hello
+TIMEOUT: float = 10.0
+
+
+def encode(message: dict) -> bytes:
+    """
+    Encode a message as one line.
+
+    Parameters
+    ----------
+    message: dict the message.
+
+    Returns
+    -------
+    bytes the line, with its newline.
+    """
+    return json.dumps(message, separators=(",", ":")).encode() + b"\n"
+
+
+def parse_address(address: str) -> tuple:
+    """
+    Split a HOST:PORT address.
+
+    Parameters
+    ----------
+    address: str e.g. 127.0.0.1:8765.
+
+    Returns
+    -------
+    tuple[str, int] host and port.
+    """
+    (host, _, port) = address.rpartition(":")
+    return (host or "127.0.0.1", int(port))
+
+
+class StationClient:
+    """
+    Connection from one station (a runner.py) to the controller.
+    If the connection fails part way through a session, the session carries
+    on with its local files only, and the results the controller missed are
+    sent again when the session is resumed.
+    """
+
+    def __init__(self, address: str, station: str = None) -> None:
+        """
+        Parameters
+        ----------
+        address: str HOST:PORT of the controller.
+        station: str name of this station. Defaults to the host name.
+        """
+        self.station = station or socket.gethostname()
+        self.sock = socket.create_connection(parse_address(address), TIMEOUT)
+        # results are small and sent one at a time; don't hold them back
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.lines = self.sock.makefile("rb")
+
+    def hello(self, session: str, resume: bool = False) -> dict:
+        """
+        Register a session with the controller.
+
+        Parameters
+        ----------
+        session: str name of the session (see runner.session_name()).
+        resume: bool whether the session is being resumed.
+
+        Returns
+        -------
+        dict the controller's answer (see the module docstring).
+        """
+        self.sock.sendall(encode({"type": "hello", "station": self.station,
+                                  "session": session, "resume": resume}))
+        line = self.lines.readline()
+        if not line:
+            raise ConnectionError("the controller closed the connection")
+        self.sock.settimeout(None)
+        return json.loads(line)
+
+    def send(self, message: dict) -> None:
+        """
+        Send a message that is not answered. Gives up on the controller
+        (with a warning) if the connection has failed.
+
+        Parameters
+        ----------
+        message: dict the message.
+
+        Returns
+        -------
+        None.
+        """
+        if self.sock is None:
+            return
+        try:
+            self.sock.sendall(encode(message))
+        except OSError as e:
+            print("Lost the controller (" + str(e) + "); results are only"
+                  + " being saved locally.")
+            self.close()
+
+    def result(self, session: str, record: tuple) -> None:
+        """
+        Send one trial's results.
+
+        Parameters
+        ----------
+        session: str name of the session.
+        record: tuple values of storage.FIELDS, in order.
+
+        Returns
+        -------
+        None.
+        """
+        self.send({"type": "result", "session": session,
+                   "record": list(record)})
+
+    def end(self, session: str, complete: bool) -> None:
+        """
+        Tell the controller a session has stopped, and disconnect.
+
+        Parameters
+        ----------
+        session: str name of the session.
+        complete: bool whether the session finished.
+
+        Returns
+        -------
+        None.
+        """
+        self.send({"type": "end", "session": session, "complete": complete})
+        self.close()
+
+    def close(self) -> None:
+        """
+        Disconnect.
+
+        Parameters
+        ----------
+        None taken.
+
+        Returns
+        -------
+        None.
+        """
+        if self.sock is not None:
+            self.lines.close()
+            self.sock.close()
+            self.sock = None
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""Append-only storage of trial results and frame timing.
+
+Each session is written as it runs to two files sharing the session's name:
+a CSV (named .csv.part until the session is complete, so unfinished
+sessions are not picked up by the analysis scripts) and a binary file of
+fixed-size records (.trials) that loads straight into a NumPy structured
+array without parsing any text. Frame timing, if logged, goes to
+data/timing/ in the same way.
+
+The progress of a session (its trial order, RNG seed and phase) is also
+checkpointed to a .session.json file, so that it can be resumed.
+
+Writes are meant to be queued on a WriterThread, so that disk I/O never
+runs on the Tk thread.
+"""
+
+import json
+import os
+import queue
+import threading
+import traceback
+import numpy as np
+
+# columns of the results, in order. trial and block count experimental
+# trials and blocks from 0, so blocks can be told apart whatever their size.
+# the stimulus parameters can take any value, not just the levels in
+# runner.py
+FIELDS = ("trial", "block", "line_length", "stim_radius", "stim_period",
+          "line_angle", "n_stim", "rating")
+RECORD_DTYPE = np.dtype([("trial", "<i4"), ("block", "<i4"),
+                         ("line_length", "<f8"),
+                         ("stim_radius", "<f8"), ("stim_period", "<f8"),
+                         ("line_angle", "<f8"), ("n_stim", "<i4"),
+                         ("rating", "<i4")])
+
+# one record per frame drawn. time is since the start of the trial; compute
+# is the time spent in update_stimulus(); jitter is how late the tick ran.
+# all in seconds.
+TIMING_DTYPE = np.dtype([("trial", "<i4"), ("frame", "<i4"),
+                         ("time", "<f8"), ("compute", "<f8"),
+                         ("jitter", "<f8")])
+# columns of the per-trial timing summary, in order
+TIMING_FIELDS = ("trial", "stim_period", "frames", "dropped",
+                 "frame_interval", "achieved_period", "max_compute",
+                 "jitter_p99")
+
+# records written between fsyncs; each record is always flushed to the OS,
+# so this only matters if the whole machine goes down
+FSYNC_EVERY: int = 10
+
+
+def format_value(value) -> str:
+    """
+    Format a number for a CSV: whole numbers without a decimal point (so
+    results at the usual levels read the same as before), anything else in
+    full.
+
+    Parameters
+    ----------
+    value: int or float the number.
+
+    Returns
+    -------
+    str the number as text.
+    """
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class TrialWriter:
+    """
+    Appends trial results to a session's files as they come in.
+    The files are created on the first append.
+    """
+
+    def __init__(self, name: str, fsync_every: int = FSYNC_EVERY) -> None:
+        """
+        Parameters
+        ----------
+        name: str path of the session's files, without extension.
+        fsync_every: int records written between fsyncs.
+        """
+        self.name = name
+        self.fsync_every = fsync_every
+        self.n_unsynced = 0
+        self.csv = None
+        self.records = None
+
+    def open(self) -> None:
+        """
+        Open the session's files for appending.
+
+        Parameters
+        ----------
+        None taken.
+
+        Returns
+        -------
+        None.
+        """
+        self.csv = open(self.name + ".csv.part", "a")
+        if self.csv.tell() == 0:
+            self.csv.write(",".join(FIELDS))
+            self.csv.write("\n")
+        self.records = open(self.name + ".trials", "ab")
+
+    def append(self, record: tuple) -> None:
+        """
+        Write one trial's results.
+
+        Parameters
+        ----------
+        record: tuple values of FIELDS, in order.
+
+        Returns
+        -------
+        None.
+        """
+        if self.csv is None:
+            self.open()
+        self.csv.write(",".join([format_value(x) for x in record]))
+        self.csv.write("\n")
+        self.records.write(np.array(record, dtype=RECORD_DTYPE).tobytes())
+        self.csv.flush()
+        self.records.flush()
+        self.n_unsynced += 1
+        if self.n_unsynced >= self.fsync_every:
+            self.sync()
+
+    def sync(self) -> None:
+        """
+        Make sure everything written so far is on disk.
+
+        Parameters
+        ----------
+        None taken.
+
+        Returns
+        -------
+        None.
+        """
+        self.csv.flush()
+        self.records.flush()
+        os.fsync(self.csv.fileno())
+        os.fsync(self.records.fileno())
+        self.n_unsynced = 0
+
+    def close(self, complete: bool = False) -> None:
+        """
+        Sync and close the session's files.
+
+        Parameters
+        ----------
+        complete: bool whether the session finished. If so, the CSV is
+        renamed to .csv, where the analysis scripts will find it.
+
+        Returns
+        -------
+        None.
+        """
+        if self.csv is None or self.csv.closed:
+            return
+        self.sync()
+        self.csv.close()
+        self.records.close()
+        if complete:
+            os.replace(self.name + ".csv.part", self.name + ".csv")
+
+
+class TimingWriter:
+    """
+    Appends the frame timing of each trial (.frames, records of
+    TIMING_DTYPE) and its summary (.csv) to a session's timing files.
+    The files are created on the first append.
+    """
+
+    def __init__(self, name: str) -> None:
+        """
+        Parameters
+        ----------
+        name: str path of the session's timing files, without extension.
+        """
+        self.name = name
+        self.csv = None
+        self.frames = None
+
+    def append(self, frames: np.array, summary: tuple) -> None:
+        """
+        Write one trial's timing.
+
+        Parameters
+        ----------
+        frames: np.array records of TIMING_DTYPE, one per frame drawn.
+        summary: tuple values of TIMING_FIELDS, in order.
+
+        Returns
+        -------
+        None.
+        """
+        if self.csv is None:
+            os.makedirs(os.path.dirname(self.name) or ".", exist_ok=True)
+            self.csv = open(self.name + ".csv", "a")
+            if self.csv.tell() == 0:
+                self.csv.write(",".join(TIMING_FIELDS))
+                self.csv.write("\n")
+            self.frames = open(self.name + ".frames", "ab")
+        self.frames.write(frames.astype(TIMING_DTYPE).tobytes())
+        self.csv.write(",".join([str(x) for x in summary]))
+        self.csv.write("\n")
+        self.frames.flush()
+        self.csv.flush()
+
+    def close(self) -> None:
+        """
+        Close the timing files.
+
+        Parameters
+        ----------
+        None taken.
+
+        Returns
+        -------
+        None.
+        """
+        if self.csv is None or self.csv.closed:
+            return
+        self.csv.close()
+        self.frames.close()
+
+
+class WriterThread(threading.Thread):
+    """
+    Runs file writes queued from the Tk thread in the background.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(name="writer", daemon=True)
+        self.queue = queue.SimpleQueue()
+
+    def submit(self, function, *args) -> None:
+        """
+        Queue a call to run on the writer thread. Never blocks.
+
+        Parameters
+        ----------
+        function: callable function to call.
+        args: arguments to call it with.
+
+        Returns
+        -------
+        None.
+        """
+        self.queue.put((function, args))
+
+    def run(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            (function, args) = item
+            try:
+                function(*args)
+            except Exception:
+                # keep going: losing one write beats losing the rest
+                traceback.print_exc()
+
+    def close(self) -> None:
+        """
+        Finish all queued writes and stop the thread.
+
+        Parameters
+        ----------
+        None taken.
+
+        Returns
+        -------
+        None.
+        """
+        self.queue.put(None)
+        self.join()
+
+
+def save_checkpoint(path: str, checkpoint: dict) -> None:
+    """
+    Save a session checkpoint. The file is replaced atomically, so a crash
+    part way through leaves the previous checkpoint intact.
+
+    Parameters
+    ----------
+    path: str path of the checkpoint file.
+    checkpoint: dict JSON-serializable state of the session.
+
+    Returns
+    -------
+    None.
+    """
+    with open(path + ".tmp", "w") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def load_checkpoint(path: str) -> dict:
+    """
+    Load a session checkpoint.
+
+    Parameters
+    ----------
+    path: str path of the checkpoint file.
+
+    Returns
+    -------
+    dict state of the session, as passed to save_checkpoint().
+    """
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def load_trials(path: str) -> np.array:
+    """
+    Load the results saved in a .trials file.
+
+    Parameters
+    ----------
+    path: str path of the file.
+
+    Returns
+    -------
+    np.array structured array with one field per column of FIELDS; pass it
+    to pd.DataFrame() for a table.
+    """
+    return np.fromfile(path, dtype=RECORD_DTYPE)
+
+
+def load_timing(path: str) -> np.array:
+    """
+    Load the per-frame timing saved in a .frames file.
+
+    Parameters
+    ----------
+    path: str path of the file.
+
+    Returns
+    -------
+    np.array structured array of TIMING_DTYPE.
+    """
+    return np.fromfile(path, dtype=TIMING_DTYPE)